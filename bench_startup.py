@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Startup time benchmark: each measure runs in a new Python process,
+so that module imports are not cached.
+
+Measures:
+ - the import of the geosurf_pure engine modules, that should load only NumPy;
+ - the import of the simulation and deformation dialogs and their construction,
+   when PyQt4 and a display are available, that should not load matplotlib.
+
+Usage:
+
+    python bench_startup.py [repetitions] > bench_output.txt
+"""
+
+
+from __future__  import division
+
+import os, sys
+import time
+import subprocess
+
+
+BENCH_REPETITIONS = 5
+
+ENGINE_MODULES = ( 'geosurf_pure.spatial', 'geosurf_pure.surf_io', 'geosurf_pure.surface_cache', 'geosurf_pure.raster' )
+
+DIALOGS = ( ( 'geosurface_simulation', 'GeosurfaceSimulationDialog' ),
+            ( 'geosurface_deformation', 'GeosurfaceDeformationDialog' ) )
+
+
+def probe_engine_import():
+
+    start_time = time.time()
+    for module_name in ENGINE_MODULES:
+        __import__( module_name )
+
+    return time.time() - start_time
+
+
+def probe_dialog( module_name, dialog_name ):
+
+    start_time = time.time()
+    from PyQt4.QtGui import QApplication
+    app = QApplication( sys.argv )
+    module = __import__( module_name )
+    import_time = time.time() - start_time
+
+    start_time = time.time()
+    dialog = getattr( module, dialog_name )( os.path.dirname( os.path.realpath( __file__ ) ), 'help/help.html' )
+    app.processEvents()
+
+    return import_time, time.time() - start_time
+
+
+def run_probe( probe_args ):
+    """
+    Runs a probe in a new process.
+
+    @return: the measured times, and whether matplotlib was loaded; None when the probe failed.
+    """
+
+    probe_process = subprocess.Popen( [ sys.executable, os.path.realpath( __file__ ), '--probe' ] + list( probe_args ),
+                                      stdout = subprocess.PIPE,
+                                      stderr = subprocess.PIPE,
+                                      cwd = os.path.dirname( os.path.realpath( __file__ ) ) )
+    output, _ = probe_process.communicate()
+    if probe_process.returncode != 0:
+        return None
+
+    values = output.split()
+
+    return [ float( value ) for value in values[ :-1 ] ], values[ -1 ] == 'True'
+
+
+def median( values ):
+
+    values = sorted( values )
+
+    return values[ len( values ) // 2 ]
+
+
+def report( label, probe_args, repetitions ):
+
+    results = [ run_probe( probe_args ) for _ in xrange( repetitions ) ]
+    if None in results:
+        print "%-45s skipped (probe failed, e.g. PyQt4 or display not available)" % label
+        return
+
+    times = zip( *[ probe_times for probe_times, _ in results ] )
+    matplotlib_loaded = any( loaded for _, loaded in results )
+    print "%-45s %s, matplotlib loaded: %s" % ( label,
+                                                ", ".join( "%.1f ms" % ( median( probe_times ) * 1000 ) for probe_times in times ),
+                                                matplotlib_loaded )
+
+
+def main( args ):
+
+    if args[ :1 ] == [ '--probe' ]:
+        if args[ 1 ] == 'engine':
+            probe_times = [ probe_engine_import() ]
+        else:
+            probe_times = probe_dialog( args[ 1 ], args[ 2 ] )
+        print " ".join( repr( probe_time ) for probe_time in probe_times ), 'matplotlib' in sys.modules
+        return
+
+    repetitions = int( args[ 0 ] ) if args else BENCH_REPETITIONS
+
+    print "Startup times (median of %d runs)" % repetitions
+    report( "import geosurf_pure engine", [ 'engine' ], repetitions )
+    for module_name, dialog_name in DIALOGS:
+        report( "%s: import, construction" % module_name, [ module_name, dialog_name ], repetitions )
+
+
+if __name__ == "__main__":
+    main( sys.argv[ 1: ] )
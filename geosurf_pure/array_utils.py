@@ -1,10 +1,11 @@
 
 from __future__  import division
 
-from numpy import *  # general import for compatibility with formula input
+import numpy as np
 from numpy.linalg import svd
 
 from .errors import AnaliticSurfaceCalcException
+from .formulas import compile_formula, eval_formula
 
 
 def point_solution( a_array, b_array ):
@@ -14,7 +15,7 @@ def point_solution( a_array, b_array ):
     """
     
     try:
-        return linalg.lstsq( a_array, b_array )[ 0 ]
+        return np.linalg.lstsq( a_array, b_array )[ 0 ]
     except:
         return None, None, None
 
@@ -29,26 +30,85 @@ def xyz_svd( xyz_array ):
         return dict( result = None )
 
 
-def formula_to_grid( array_range, array_size, formula ):
+def grid_axes( array_range, array_size, dtype=float ):
     
     a_min, a_max, b_max, b_min = array_range # note: b range reversed for conventional j order in arrays
     array_rows, array_cols = array_size
     
-    a_array = linspace( a_min, a_max, num=array_cols )
-    b_array = linspace( b_max, b_min, num=array_rows ) # note: reversed for conventional j order in arrays
+    a_array = np.linspace( a_min, a_max, num=array_cols ).astype( dtype, copy=False )
+    b_array = np.linspace( b_max, b_min, num=array_rows ).astype( dtype, copy=False ) # note: reversed for conventional j order in arrays
+    
+    return a_array, b_array
+
 
+def formula_to_arrays( formula, a_array, b_array, dtype=float ):
+    """
+    Evaluates the formula over the whole grid defined by the a and b values.
+    The compiled formula is evaluated once over the meshgrid arrays;
+    only when it cannot be vectorized (e.g. it uses Python conditionals
+    or scalar-only functions) it falls back to a point by point evaluation.
+    
+    Returns the a, b and z 2D arrays, with shape (a size, b size),
+    i.e. in the a-then-b order of the point lists, and with the given float type.
+    """
+    
+    code = compile_formula( formula )
+    
     try:
-        a_list, b_list = [ a for a in a_array for b in b_array ], [ b for a in a_array for b in b_array ]
-    except: 
+        a_grid, b_grid = np.meshgrid( np.asarray( a_array, dtype=dtype ), np.asarray( b_array, dtype=dtype ), indexing='ij' )
+    except:
         raise AnaliticSurfaceCalcException, "Error in a-b values"
     
     try:
-        z_list = [ eval( formula ) for a in a_array for b in b_array ]
+        z_grid = eval_formula( code, a_grid, b_grid )
+        z_grid = np.array( np.broadcast_to( z_grid, a_grid.shape ), dtype=dtype )
     except:
-        raise AnaliticSurfaceCalcException, "Error in applying formula to a and b array values"
+        try:
+            z_grid = np.array( [ [ eval_formula( code, a, b ) for b in b_array ] for a in a_array ], 
+                               dtype=dtype )
+        except:
+            raise AnaliticSurfaceCalcException, "Error in applying formula to a and b array values"
+    
+    return a_grid, b_grid, z_grid.reshape( a_grid.shape )
+    
+    
+def formula_to_grid( array_range, array_size, formula ):
+    
+    a_array, b_array = grid_axes( array_range, array_size )
+    
+    a_grid, b_grid, z_grid = formula_to_arrays( formula, a_array, b_array )
          
-    return a_list, b_list, z_list
+    return a_grid.ravel().tolist(), b_grid.ravel().tolist(), z_grid.ravel().tolist()
             
 
  
 
+
+def format_array_rows( values_array, decimals, suffixes ):
+    """
+    Formats the rows of a 2D numeric array as text, with a single string formatting operation:
+    each value is formatted with '%.<decimals>f' (or '%d' for integer arrays) 
+    and followed by the suffix of its column.
+    
+    @param values_array: the values to format, shape (rows, cols).
+    @type values_array: numpy.array.
+    @param decimals: number of decimal digits of the float values.
+    @type decimals: int.
+    @param suffixes: the strings following the values of each column (e.g. separators and newlines).
+    @type suffixes: list of strings.
+    
+    @return: string.
+    """
+    
+    values_array = np.asarray( values_array )
+    n_rows, n_cols = values_array.shape
+    assert len( suffixes ) == n_cols
+    
+    if np.issubdtype( values_array.dtype, np.integer ):
+        # integers converted with str and inserted with '%s': faster than '%d', with the same result
+        value_format, values = '%s', map( str, values_array.ravel().tolist() )
+    else:
+        value_format, values = '%%.%df' % decimals, values_array.ravel().tolist()
+    row_format = ''.join( value_format + suffix.replace( '%', '%%' ) for suffix in suffixes )
+    
+    return ( row_format * n_rows ) % tuple( values )
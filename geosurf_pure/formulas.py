@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import __future__
+import __builtin__
+
+import ast
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .errors import AnaliticSurfaceCalcException
+
+
+FORMULA_CACHE_SIZE = 128
+
+FORMULA_VARIABLES = ( 'a', 'b' )
+
+# NumPy functions and constants usable in the analytical formulas
+FORMULA_NUMPY_NAMES = ( 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'hypot',
+                        'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh',
+                        'degrees', 'radians', 'deg2rad', 'rad2deg',
+                        'exp', 'exp2', 'expm1', 'log', 'log2', 'log10', 'log1p',
+                        'sqrt', 'cbrt', 'square', 'power',
+                        'absolute', 'fabs', 'sign', 'floor', 'ceil', 'rint', 'trunc', 'around',
+                        'mod', 'fmod', 'remainder', 'maximum', 'minimum', 'fmax', 'fmin',
+                        'clip', 'where', 'sinc', 'heaviside',
+                        'logical_and', 'logical_or', 'logical_not',
+                        'pi', 'e' )
+
+# Python built-ins previously reachable by the formulas
+FORMULA_BUILTIN_NAMES = ( 'abs', 'max', 'min', 'round', 'pow', 'float', 'int', 'True', 'False' )
+
+FORMULA_AST_NODES = ( 'Expression', 'BinOp', 'UnaryOp', 'BoolOp', 'Compare', 'IfExp', 'Call', 'keyword',
+                      'Name', 'Load', 'Num', 'Constant', 'NameConstant', 'Tuple',
+                      'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow',
+                      'UAdd', 'USub', 'Not', 'Invert', 'BitAnd', 'BitOr', 'BitXor', 'And', 'Or',
+                      'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE' )
+
+
+def formula_namespace():
+    """
+    Creates the namespace in which the compiled formulas are evaluated:
+    only the whitelisted NumPy and Python names are available.
+    """
+
+    namespace = dict( __builtins__ = {} )
+    for name in FORMULA_NUMPY_NAMES:
+        if hasattr( np, name ):
+            namespace[ name ] = getattr( np, name )
+    for name in FORMULA_BUILTIN_NAMES:
+        namespace[ name ] = getattr( __builtin__, name )
+
+    return namespace
+
+
+FORMULA_NAMESPACE = formula_namespace()
+
+# names allowed in the formulas: the namespace cannot be used for the check, since it also defines __builtins__
+FORMULA_NAMES = frozenset( FORMULA_VARIABLES + FORMULA_BUILTIN_NAMES + 
+                           tuple( name for name in FORMULA_NUMPY_NAMES if hasattr( np, name ) ) )
+
+_compiled_formulas = OrderedDict()
+
+
+def check_formula( formula_tree ):
+    """
+    Checks that the formula AST uses only allowed syntax elements and names.
+    """
+
+    for node in ast.walk( formula_tree ):
+        node_type = type( node ).__name__
+        if node_type not in FORMULA_AST_NODES:
+            raise AnaliticSurfaceCalcException, "Formula syntax element not allowed: %s" % node_type
+        if node_type == 'Name' and node.id not in FORMULA_NAMES:
+            raise AnaliticSurfaceCalcException, "Formula name not allowed: %s" % node.id
+        if node_type == 'Call' and type( node.func ).__name__ != 'Name':
+            raise AnaliticSurfaceCalcException, "Formula function call not allowed"
+
+
+def compile_formula( formula ):
+    """
+    Parses, validates and compiles an analytical formula.
+    Compiled formulas are kept in a bounded LRU cache keyed by the formula text,
+    so that repeated surface creations skip parsing entirely.
+
+    @return: code object to be evaluated with eval_formula.
+    """
+
+    try:
+        code = _compiled_formulas.pop( formula )
+    except KeyError:
+        try:
+            formula_tree = ast.parse( formula.strip(), mode='eval' )
+        except SyntaxError:
+            raise AnaliticSurfaceCalcException, "Formula syntax error"
+        check_formula( formula_tree )
+        code = compile( formula_tree, '<formula>', 'eval', __future__.division.compiler_flag, True )
+
+    _compiled_formulas[ formula ] = code
+    while len( _compiled_formulas ) > FORMULA_CACHE_SIZE:
+        _compiled_formulas.popitem( last=False )
+
+    return code
+
+
+def eval_formula( code, a, b ):
+    """
+    Evaluates a compiled formula for the given a and b values (scalars or arrays).
+    """
+
+    return eval( code, FORMULA_NAMESPACE, dict( a = a, b = b ) )
+
+
+def clear_formula_cache():
+
+    _compiled_formulas.clear()
+
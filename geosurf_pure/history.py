@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+HISTORY_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes
+
+
+class DeformationHistory( object ):
+    """
+    Undo/redo history of the deformation states of a geosurface.
+
+    State 0 is the georeferenced, undeformed surface, obtained by applying
+    the root matrix to the root (analytical) points;
+    state i is the surface after the first i deformations.
+
+    Node arrays of the visited states are cached within a memory budget:
+    when over budget, the least recently used ones are evicted,
+    and they are recalculated on demand from the nearest cached ancestor state.
+    """
+
+    def __init__( self, root_xyz, root_matrix, memory_budget = HISTORY_MEMORY_BUDGET ):
+        """
+        @param root_xyz: the (n, 3) array of the root points. It is not copied.
+        @type root_xyz: numpy.array.
+        @param root_matrix: 4x4 homogeneous matrix transforming the root points into state 0.
+        @type root_matrix: numpy.array.
+        @param memory_budget: maximum size in bytes of the cached state arrays.
+        @type memory_budget: int.
+        """
+
+        self._root_xyz = root_xyz
+        self._root_matrix = root_matrix
+        self.memory_budget = memory_budget
+
+        self._steps = []  # ( deformation parameters, homogeneous matrix ) from state i to state i+1
+        self._position = 0
+        self._cached_states = OrderedDict()
+
+
+    def _get_position( self ):
+
+        return self._position
+
+    position = property( _get_position )
+
+
+    def num_states( self ):
+
+        return len( self._steps ) + 1
+
+
+    def can_undo( self ):
+
+        return self._position > 0
+
+
+    def can_redo( self ):
+
+        return self._position < len( self._steps )
+
+
+    def cached_bytes( self ):
+
+        return sum( xyz.nbytes for xyz in self._cached_states.itervalues() )
+
+
+    def deform_params( self, state_ndx = None ):
+        """
+        Deformation parameters leading to the given state (default: current state).
+        """
+
+        if state_ndx is None:
+            state_ndx = self._position
+
+        return [ deform_param for deform_param, _ in self._steps[ :state_ndx ] ]
+
+
+    def state_matrix( self, state_ndx = None, from_state_ndx = None ):
+        """
+        Homogeneous matrix transforming the points of a state (default: the root points)
+        into those of the given state (default: current state).
+        """
+
+        if state_ndx is None:
+            state_ndx = self._position
+
+        if from_state_ndx is None:
+            total_matrix = self._root_matrix
+            first_step_ndx = 0
+        else:
+            total_matrix = np.identity( 4 )
+            first_step_ndx = from_state_ndx
+
+        for _, matrix in self._steps[ first_step_ndx:state_ndx ]:
+            total_matrix = np.dot( matrix, total_matrix )
+
+        return total_matrix
+
+
+    def push( self, deform_param, matrix, xyz = None ):
+        """
+        Adds a deformation after the current state, discarding the states that could be redone.
+
+        @param deform_param: the deformation parameters.
+        @type deform_param: dict.
+        @param matrix: the 4x4 homogeneous matrix of the deformation.
+        @type matrix: numpy.array.
+        @param xyz: the optional (n, 3) array of the new state, to be cached as a copy.
+        @type xyz: numpy.array.
+        """
+
+        del self._steps[ self._position: ]
+        for state_ndx in self._cached_states.keys():
+            if state_ndx > self._position:
+                del self._cached_states[ state_ndx ]
+
+        self._steps.append( ( deform_param, matrix ) )
+        self._position += 1
+
+        if xyz is not None:
+            self._cache_state( self._position, xyz.copy() )
+
+
+    def undo( self, calculate_state = True ):
+        """
+        Moves to the previous state.
+
+        @return: the (n, 3) array of the new current state, that should not be modified,
+                 or None when not calculate_state.
+        """
+
+        assert self.can_undo()
+
+        self._position -= 1
+
+        if calculate_state:
+            return self.state_xyz()
+
+
+    def redo( self, calculate_state = True ):
+        """
+        Moves to the next state.
+
+        @return: the (n, 3) array of the new current state, that should not be modified,
+                 or None when not calculate_state.
+        """
+
+        assert self.can_redo()
+
+        self._position += 1
+
+        if calculate_state:
+            return self.state_xyz()
+
+
+    def state_xyz( self, state_ndx = None ):
+        """
+        Returns the (n, 3) array of a state (default: current state),
+        from the cache or recalculated from the nearest cached ancestor.
+        """
+
+        from .spatial import apply_homogeneous_matrix
+
+        if state_ndx is None:
+            state_ndx = self._position
+
+        try:
+            xyz = self._cached_states.pop( state_ndx )
+        except KeyError:
+            cached_ancestors = [ ndx for ndx in self._cached_states if ndx < state_ndx ]
+            if cached_ancestors:
+                ancestor_ndx = max( cached_ancestors )
+                xyz = apply_homogeneous_matrix( self._cached_states[ ancestor_ndx ],
+                                                self.state_matrix( state_ndx, ancestor_ndx ) )
+            else:
+                xyz = apply_homogeneous_matrix( self._root_xyz,
+                                                self.state_matrix( state_ndx ) )
+
+        self._cache_state( state_ndx, xyz )
+
+        return xyz
+
+
+    def _cache_state( self, state_ndx, xyz ):
+
+        self._cached_states[ state_ndx ] = xyz
+
+        cached_bytes = self.cached_bytes()
+        while cached_bytes > self.memory_budget and self._cached_states:
+            _, evicted_xyz = self._cached_states.popitem( last = False )
+            cached_bytes -= evicted_xyz.nbytes
+
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import numpy as np
+
+from .spatial import Grid, RectangularDomain, Point3D, column_bands, TILE_SIZE
+from .topology import band_triangles
+from .errors import RasterParametersException
+
+
+RASTER_CHUNK_SIZE = 1024 * 1024 # maximum number of (triangle, cell) candidate pairs processed at a time
+
+BARYCENTRIC_TOLERANCE = 1e-9
+
+
+def rasterize_surface( geosurface, cell_size, z_statistic = 'max', tile_size = TILE_SIZE ):
+    """
+    Resamples a triangulated grid surface onto a regular XY raster,
+    interpolating the z value of each cell center with barycentric coordinates
+    within the triangles that contain it.
+    Where the surface is multivalued (e.g., after folding or rotation),
+    the maximum or the minimum z value is kept.
+    Cells not covered by the surface are NaN.
+
+    @param geosurface: the surface to rasterize.
+    @type geosurface: GridSurface.
+    @param cell_size: the raster cell size.
+    @type cell_size: float.
+    @param z_statistic: 'max' or 'min'.
+    @type z_statistic: string.
+    @param tile_size: approximate number of nodes of the surface bands processed at a time.
+    @type tile_size: int.
+
+    @return: Grid.
+    """
+
+    try:
+        cell_size = float( cell_size )
+    except ( TypeError, ValueError ):
+        raise RasterParametersException, "Cell size error"
+    if not cell_size > 0:
+        raise RasterParametersException, "Cell size must be positive"
+
+    if z_statistic == 'max':
+        z_init, z_accumulate = -np.inf, np.maximum
+    elif z_statistic == 'min':
+        z_init, z_accumulate = np.inf, np.minimum
+    else:
+        raise RasterParametersException, "Z statistic must be 'max' or 'min'"
+
+    ( x_min, x_max ), ( y_min, y_max ), _ = geosurface.bounds( tile_size )
+
+    raster_cols = max( 1, int( np.ceil( ( x_max - x_min ) / cell_size ) ) )
+    raster_rows = max( 1, int( np.ceil( ( y_max - y_min ) / cell_size ) ) )
+    y_top = y_min + raster_rows * cell_size
+
+    raster_z = np.full( raster_rows * raster_cols, z_init )
+
+    grid_dims = geosurface.grid_dims
+    grid_rows, grid_cols = grid_dims
+    for start_col, end_col in column_bands( grid_cols - 1, max( 1, tile_size // grid_rows ) ):
+        band_xyz = geosurface.column_band( start_col, end_col + 1 ).xyz
+        triangles = band_triangles( ( grid_rows, end_col - start_col ) )
+        cell_ndxs, cell_z = rasterize_triangles( band_xyz[ triangles ], x_min, y_top, cell_size, raster_rows, raster_cols )
+        z_accumulate.at( raster_z, cell_ndxs, cell_z )
+
+    raster_z[ np.isinf( raster_z ) ] = np.nan
+
+    raster = Grid( grid_data = raster_z.reshape( raster_rows, raster_cols ) )
+    raster.domain = RectangularDomain( Point3D( x_min, y_min ),
+                                       Point3D( x_min + raster_cols * cell_size, y_top ) )
+
+    return raster
+
+
+def rasterize_triangles( triangles_xyz, x_min, y_top, cell_size, raster_rows, raster_cols ):
+    """
+    Finds the raster cells whose centers lie within the XY projection of the triangles,
+    and interpolates the triangle z values at the cell centers.
+    The candidate cells are those within the triangle bounding boxes;
+    they are processed in chunks of at most RASTER_CHUNK_SIZE,
+    so that memory use is bounded also for triangles much larger than the cells.
+
+    @param triangles_xyz: triangle vertex coordinates, shape (n, 3, 3).
+    @type triangles_xyz: numpy.array.
+
+    @return: tuple of two numpy.array: raveled cell indices and z values.
+    """
+
+    x, y = triangles_xyz[ :, :, 0 ], triangles_xyz[ :, :, 1 ]
+
+    # ranges of the cell centers within the triangle bounding boxes
+    start_cols = np.maximum( np.ceil( ( x.min( axis = 1 ) - x_min ) / cell_size - 0.5 ), 0 ).astype( np.int64 )
+    end_cols = np.minimum( np.floor( ( x.max( axis = 1 ) - x_min ) / cell_size - 0.5 ), raster_cols - 1 ).astype( np.int64 ) + 1
+    start_rows = np.maximum( np.ceil( ( y_top - y.max( axis = 1 ) ) / cell_size - 0.5 ), 0 ).astype( np.int64 )
+    end_rows = np.minimum( np.floor( ( y_top - y.min( axis = 1 ) ) / cell_size - 0.5 ), raster_rows - 1 ).astype( np.int64 ) + 1
+
+    n_cols = np.maximum( end_cols - start_cols, 0 )
+    n_candidates = n_cols * np.maximum( end_rows - start_rows, 0 )
+    candidates_end = np.cumsum( n_candidates )
+
+    cell_ndxs_list, cell_z_list = [], []
+    start_triangle = 0
+    while start_triangle < len( triangles_xyz ):
+        candidates_start = candidates_end[ start_triangle ] - n_candidates[ start_triangle ]
+        end_triangle = max( start_triangle + 1,
+                            np.searchsorted( candidates_end, candidates_start + RASTER_CHUNK_SIZE, side = 'right' ) )
+        chunk = slice( start_triangle, end_triangle )
+        start_triangle = end_triangle
+
+        # candidate (triangle, cell) pairs
+        triangle_ndxs = np.repeat( np.arange( chunk.start, chunk.stop ), n_candidates[ chunk ] )
+        if len( triangle_ndxs ) == 0:
+            continue
+        candidate_offsets = np.arange( len( triangle_ndxs ) ) - np.repeat( candidates_end[ chunk ] - n_candidates[ chunk ] - candidates_start,
+                                                                           n_candidates[ chunk ] )
+        cell_rows = start_rows[ triangle_ndxs ] + candidate_offsets // n_cols[ triangle_ndxs ]
+        cell_cols = start_cols[ triangle_ndxs ] + candidate_offsets % n_cols[ triangle_ndxs ]
+
+        cell_x = x_min + ( cell_cols + 0.5 ) * cell_size
+        cell_y = y_top - ( cell_rows + 0.5 ) * cell_size
+
+        # barycentric coordinates of the cell centers
+        x0, x1, x2 = x[ triangle_ndxs, 0 ], x[ triangle_ndxs, 1 ], x[ triangle_ndxs, 2 ]
+        y0, y1, y2 = y[ triangle_ndxs, 0 ], y[ triangle_ndxs, 1 ], y[ triangle_ndxs, 2 ]
+        denominator = ( y1 - y2 ) * ( x0 - x2 ) + ( x2 - x1 ) * ( y0 - y2 )
+        valid_triangles = denominator != 0
+        denominator = np.where( valid_triangles, denominator, 1.0 )
+        weight_0 = ( ( y1 - y2 ) * ( cell_x - x2 ) + ( x2 - x1 ) * ( cell_y - y2 ) ) / denominator
+        weight_1 = ( ( y2 - y0 ) * ( cell_x - x2 ) + ( x0 - x2 ) * ( cell_y - y2 ) ) / denominator
+        weight_2 = 1.0 - weight_0 - weight_1
+
+        inside = valid_triangles & ( weight_0 >= -BARYCENTRIC_TOLERANCE ) & \
+                                   ( weight_1 >= -BARYCENTRIC_TOLERANCE ) & \
+                                   ( weight_2 >= -BARYCENTRIC_TOLERANCE )
+
+        z = triangles_xyz[ triangle_ndxs, :, 2 ]
+        cell_z = weight_0 * z[ :, 0 ] + weight_1 * z[ :, 1 ] + weight_2 * z[ :, 2 ]
+
+        cell_ndxs_list.append( ( cell_rows * raster_cols + cell_cols )[ inside ] )
+        cell_z_list.append( cell_z[ inside ] )
+
+    if not cell_ndxs_list:
+        return np.zeros( 0, dtype = np.int64 ), np.zeros( 0 )
+
+    return np.concatenate( cell_ndxs_list ), np.concatenate( cell_z_list )
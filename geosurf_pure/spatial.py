@@ -4,18 +4,23 @@ from __future__  import division
 
 from math import sqrt, floor, ceil, sin, cos, tan, radians, asin, acos, atan, atan2, degrees
 
+import os
+
 import numpy as np
 
 import copy
 
 from .utils import array_from_function, almost_zero
-from array_utils import point_solution, formula_to_grid
+from .array_utils import point_solution, grid_axes, formula_to_arrays
 from .errors import AnaliticSurfaceIOException, AnaliticSurfaceCalcException
+from .history import DeformationHistory, HISTORY_MEMORY_BUDGET
 
 
 MINIMUM_SEPARATION_THRESHOLD = 1e-10
 MINIMUM_VECTOR_MAGNITUDE = 1e-10
 
+TILE_SIZE = 1024 * 1024 # approximate number of nodes in the tiles used for surface calculations
+
 
 
 class Point2D( object ):
@@ -1850,94 +1855,593 @@ class Triangle( object ):
             return True
     
 
+
+class GridSurface( object ):
+    """
+    Surface defined by nodes on a regular (rows, cols) grid topology.
+    
+    Node coordinates are stored in a single contiguous float array, 
+    column after column (i.e., in the a-then-b order of the analytical grid),
+    so that the grid (rows, cols, 3) array, the (n, 3) array 
+    and the X, Y and Z coordinates are all views without copies.
+    """
+    
+    def __init__( self, nodes_array ):
+        """
+        @param nodes_array: node coordinates, shape (cols, rows, 3).
+        @type nodes_array: numpy.array.
+        """
+        
+        assert nodes_array.ndim == 3 and nodes_array.shape[2] == 3
+        
+        self._nodes = nodes_array
+        
+    
+    @classmethod
+    def empty( cls, grid_dims, dtype = float ):
+        
+        grid_rows, grid_cols = grid_dims
+        
+        return cls( np.empty( ( grid_cols, grid_rows, 3 ), dtype = dtype ) )
+    
+    
+    @classmethod
+    def from_arrays( cls, X, Y, Z, grid_dims, dtype = float ):
+        """
+        Creates a grid surface from the X, Y and Z coordinates,
+        stored in the a-then-b order (lists or arrays).
+        """
+        
+        surface = cls.empty( grid_dims, dtype )
+        surface.X[:] = np.ravel( X )
+        surface.Y[:] = np.ravel( Y )
+        surface.Z[:] = np.ravel( Z )
+        
+        return surface
+    
+    
+    @classmethod
+    def memmap( cls, filepath, grid_dims, dtype = float, mode = 'w+', offset = 0 ):
+        """
+        Creates a grid surface backed by a memory-mapped file,
+        whose coordinates start at the given byte offset.
+        """
+        
+        grid_rows, grid_cols = grid_dims
+        
+        return cls( np.memmap( filepath, dtype = dtype, mode = mode, offset = offset, shape = ( grid_cols, grid_rows, 3 ) ) )
+    
+    
+    def clone( self ):
+        
+        return GridSurface( np.array( self._nodes ) )
+    
+    
+    def is_memmap( self ):
+        
+        return isinstance( self._nodes, np.memmap )
+    
+    
+    def flush( self ):
+        """
+        Writes changes to disk, for memory-mapped surfaces.
+        """
+        
+        if self.is_memmap():
+            self._nodes.flush()
+    
+    
+    def column_band( self, start_col, end_col ):
+        """
+        Band of grid columns, as a GridSurface view of the current one.
+        """
+        
+        return GridSurface( self._nodes[ start_col:end_col ] )
+    
+    
+    def subsampled( self, row_step, col_step ):
+        """
+        Grid surface with the nodes of every row_step rows and col_step columns,
+        always including the last row and column, so that the surface extent is kept.
+        """
+        
+        grid_rows, grid_cols = self.grid_dims
+        
+        row_ndxs = subsample_indices( grid_rows, row_step )
+        col_ndxs = subsample_indices( grid_cols, col_step )
+        
+        return GridSurface( np.ascontiguousarray( self._nodes[ col_ndxs ][ :, row_ndxs ] ) )
+    
+    
+    def column_bands( self, band_cols ):
+        """
+        Iterates over bands of grid columns, as GridSurface views.
+        """
+        
+        _, grid_cols = self.grid_dims
+        for start_col, end_col in column_bands( grid_cols, band_cols ):
+            yield self.column_band( start_col, end_col )
+    
+    
+    def bounds( self, tile_size = TILE_SIZE ):
+        """
+        Calculates the coordinate ranges tile by tile, 
+        so that memory-mapped surfaces are not loaded as a whole.
+        
+        @return: tuple of three (min, max) tuples, for the x, y and z coordinates.
+        """
+        
+        grid_rows, _ = self.grid_dims
+        
+        mins, maxs = np.full( 3, np.inf ), np.full( 3, -np.inf )
+        for band in self.column_bands( max( 1, tile_size // grid_rows ) ):
+            mins = np.minimum( mins, band.xyz.min( axis = 0 ) )
+            maxs = np.maximum( maxs, band.xyz.max( axis = 0 ) )
+            
+        return tuple( zip( mins.tolist(), maxs.tolist() ) )
+    
+    
+    def _grid_dims( self ):
+        
+        grid_cols, grid_rows, _ = self._nodes.shape
+        
+        return grid_rows, grid_cols
+    
+    grid_dims = property( _grid_dims )
+    
+    
+    def _num_nodes( self ):
+        
+        return self._nodes.shape[0] * self._nodes.shape[1]
+    
+    num_nodes = property( _num_nodes )
+    
+    
+    def _dtype( self ):
+        
+        return self._nodes.dtype
+    
+    dtype = property( _dtype )
+    
+    
+    def _nodes_by_column( self ):
+        
+        return self._nodes
+    
+    nodes_by_column = property( _nodes_by_column )
+    
+    
+    def _nodes_grid( self ):
+        """
+        Grid array of the node coordinates, shape (rows, cols, 3).
+        """
+        
+        return self._nodes.transpose( 1, 0, 2 )
+    
+    nodes = property( _nodes_grid )
+    
+    
+    def _xyz( self ):
+        """
+        Node coordinates as an (n, 3) array, in the a-then-b order.
+        """
+        
+        return self._nodes.reshape( -1, 3 )
+    
+    xyz = property( _xyz )
+    
+        
+    def _X( self ):
+        
+        return self.xyz[:, 0]
+    
+    X = property( _X )
+    
+    
+    def _Y( self ):
+        
+        return self.xyz[:, 1]
+    
+    Y = property( _Y )
+    
+    
+    def _Z( self ):
+        
+        return self.xyz[:, 2]
+    
+    Z = property( _Z )
+    
+    
+    def __iter__( self ):
+        """
+        Allows the unpacking as X, Y, Z, like the previous coordinate lists.
+        """
+        
+        return iter( ( self.X, self.Y, self.Z ) )
+        
+    
+def subsample_indices( num_values, step ):
+    """
+    Indices of every step values, plus the last one.
+    """
+    
+    return np.unique( np.append( np.arange( 0, num_values, step ), num_values - 1 ) )
+
+
+def column_bands( grid_cols, band_cols ):
+    """
+    Splits the grid columns into bands.
+    
+    @return: list of ( start column, end column ) tuples.
+    """
+    
+    return [ ( start_col, min( start_col + band_cols, grid_cols ) ) for start_col in xrange( 0, grid_cols, band_cols ) ]
+
+
+def as_grid_surface( surface_XYZ, grid_dims, dtype = float ):
+    """
+    Returns a GridSurface instance from a GridSurface (returned as it is)
+    or from X, Y and Z coordinate lists, stored with the given float type.
+    """
+    
+    if isinstance( surface_XYZ, GridSurface ):
+        assert surface_XYZ.grid_dims == tuple( grid_dims )
+        return surface_XYZ
+    
+    X, Y, Z = surface_XYZ
+    
+    return GridSurface.from_arrays( X, Y, Z, grid_dims, dtype )
+    
                
 class AnalyticGeosurface( object ):   
        
     
-    def __init__( self, analytical_params, geogr_params, deform_params ):
+    def __init__( self, analytical_params, geogr_params, deform_params, history_memory_budget = HISTORY_MEMORY_BUDGET,
+                  memmap_filepath = None, tile_size = TILE_SIZE, workers = 1, dtype = float, 
+                  geosurface = None, z_range = None ):
+        """
+        @param memmap_filepath: when defined, the geosurface is calculated out-of-core, 
+                                tile by tile, into a memory-mapped file with this path, 
+                                and the analytical surface is not kept in memory.
+        @type memmap_filepath: string.
+        @param tile_size: approximate number of nodes of each tile (i.e., band of grid columns).
+        @type tile_size: int.
+        @param workers: number of processes used to evaluate and transform the analytical surface, tile by tile
+                        (None: all the available cores). When the surface is calculated in memory, 
+                        the georeferenced and deformed surface is then calculated together with the analytical one.
+        @type workers: int.
+        @param dtype: float type of the surface node coordinates, e.g. numpy.float32 to halve memory use.
+                      Transformation matrices are always composed in double precision.
+        @type dtype: numpy float type.
+        @param geosurface: the already calculated (e.g., stored) georeferenced and deformed surface:
+                           when defined, the analytical surface is evaluated only when needed 
+                           for undoing or redoing deformations.
+        @type geosurface: GridSurface.
+        @param z_range: the z range of the analytical surface, when the geosurface is defined.
+        @type z_range: tuple of two floats.
+        """
         
         self.analytical_params = analytical_params
         self.geographical_params = geogr_params        
-        self.deformational_params = deform_params
+        self.deformational_params = list( deform_params )
+        self.memmap_filepath = memmap_filepath
+        self.tile_size = tile_size
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.dtype = np.dtype( dtype )
 
         # extract array params
         self.anal_param_values = self.get_analytical_param_values()
         array_range, array_size, formula = self.anal_param_values
-        a_min, a_max, b_min, b_max = array_range
-        a_range, b_range = a_max-a_min, b_max-b_min
+        self.a_array, self.b_array = grid_axes( array_range, array_size, self.dtype )
+        self.z_range = z_range
+        if geosurface is not None and tuple( geosurface.grid_dims ) != self.grid_dims():
+            raise AnaliticSurfaceIOException, "Surface grid dims do not match the analytical parameters"
 
-        # calculate array from formula    
-        try:
-            self.X, self.Y, self.Z = formula_to_grid( array_range, array_size, formula ) 
-        except AnaliticSurfaceCalcException, msg:
-            raise AnaliticSurfaceCalcException, msg
-                
         # calculate geographic transformations to surface
         self.geographical_values = self.get_geographical_param_values()
-        (geog_x_min, geog_y_min), (area_height, area_width), area_rot_ang_deg = self.geographical_values   
-        geog_scale_matr = geographic_scale_matrix( a_range, b_range, area_height, area_width )
-        geogr_rot_matrix = geographic_rotation_matrix( area_rot_ang_deg )
-    
-        self.geographic_transformation_matrix = np.dot( geogr_rot_matrix, geog_scale_matr )
-    
-        self.geographic_offset_matrix = geographic_offset( self.geographic_transformation_matrix, 
-                                                        np.array( [a_min, b_min, 0.0] ),
-                                                        np.array( [geog_x_min, geog_y_min, 0.0] ) )
+        self.geographic_transformation_matrix, self.geographic_offset_matrix = geographic_transformation( array_range, 
+                                                                                                          self.geographical_values )
     
-        # apply total transformations to grid points 
+        # total transformations to grid points 
         self.deformations = deformation_matrices( self.deformational_params )          
+        self.transformation_matrix = compose_transformation( self.geographic_transformation_matrix, 
+                                                             self.geographic_offset_matrix, 
+                                                             self.deformations )
+        
+        # calculate array from formula, unless out-of-core or already calculated
+        if self.memmap_filepath is None and geosurface is None:
+            if self.workers > 1:
+                self.analytical_surface, geosurface = self.parallel_surfaces()
+            else:
+                self.analytical_surface = self.analytical_band( 0, len( self.a_array ) )
+            self.X, self.Y, self.Z = self.analytical_surface
+            self.z_range = self.Z.min(), self.Z.max()
+            history_root_xyz = self.analytical_surface.xyz
+        else:
+            self.analytical_surface = None
+            self.X = self.Y = self.Z = None
+            history_root_xyz = None
+            history_memory_budget = 0
+                
+        # georeferenced and deformed surface, lazily calculated (unless calculated by the worker processes) 
+        # and then incrementally updated
+        self.geosurface = geosurface
+        
+        # undo/redo history of the deformations
+        self.history = DeformationHistory( history_root_xyz,
+                                           homogeneous_matrix( self.geographic_transformation_matrix,
+                                                               self.geographic_offset_matrix ),
+                                           history_memory_budget )
+        for deform_param, deformation in zip( self.deformational_params, self.deformations ):
+            self.history.push( deform_param, deformation_homogeneous_matrix( deformation ) )
 
 
+    def is_out_of_core( self ):
+        
+        return self.memmap_filepath is not None
+    
+    
+    def has_analytical_surface( self ):
+        """
+        Whether the analytical surface is kept in memory, 
+        otherwise it is evaluated tile by tile when needed.
+        """
+        
+        return self.analytical_surface is not None
+    
+    
+    def grid_dims( self ):
+        
+        return len( self.b_array ), len( self.a_array )
+    
+    
+    def tile_bands( self ):
+        """
+        Column bands, i.e. tiles, used for the surface calculations.
+        """
+        
+        grid_rows, grid_cols = self.grid_dims()
+        
+        band_cols = max( 1, self.tile_size // grid_rows )
+        if self.workers > 1:
+            band_cols = min( band_cols, max( 1, grid_cols // ( 4 * self.workers ) ) )
+        
+        return column_bands( grid_cols, band_cols )
+    
+    
+    def analytical_band( self, start_col, end_col ):
+        """
+        Calculates the analytical surface for a band of grid columns.
+        
+        @return: GridSurface.
+        """
+        
+        _, _, formula = self.anal_param_values
+        
+        return analytical_grid_surface( formula, self.a_array[ start_col:end_col ], self.b_array, self.dtype )
+        
+        
+    def parallel_surfaces( self ):
+        """
+        Calculates the analytical surface and the georeferenced and deformed surface 
+        with a pool of worker processes, that evaluate and transform each tile,
+        through two temporary memory-mapped files.
+        
+        @return: the analytical surface and the geosurface - two GridSurface.
+        """
+        
+        import tempfile
+        
+        temp_filepaths = []
+        try:
+            for _ in xrange( 2 ):
+                temp_file, temp_filepath = tempfile.mkstemp( suffix = '.geosurf' )
+                os.close( temp_file )
+                temp_filepaths.append( temp_filepath )
+                GridSurface.memmap( temp_filepath, self.grid_dims(), self.dtype ).flush()
+            analytical_filepath, geosurface_filepath = temp_filepaths
+            calculate_surface_bands( self.analytical_params, self.transformation_matrix, geosurface_filepath, 
+                                     self.tile_bands(), self.workers, self.dtype, 
+                                     analytical_filepath = analytical_filepath )
+            surfaces = [ GridSurface.memmap( temp_filepath, self.grid_dims(), self.dtype, mode = 'r' ).clone() 
+                         for temp_filepath in temp_filepaths ]
+        finally:
+            for temp_filepath in temp_filepaths:
+                os.remove( temp_filepath )
+            
+        return surfaces
+        
+        
     def geosurface_center( self ):
 
         array_range, _, _ = self.anal_param_values
         a_min, a_max, b_min, b_max = array_range
         
-        (geog_x_min, geog_y_min), (area_height, area_width), _ = self.geographical_values         
+        z_min, z_max = self.surface_z_range()
+                
         x = ( a_min + a_max ) / 2.0
         y = ( b_min + b_max ) / 2.0
-        z = ( min( self.Z) + max(self.Z) ) / 2.0
+        z = ( z_min + z_max ) / 2.0
         
         return self.transform_loc( x, y, z )       
     
     
+    def surface_z_range( self ):
+        """
+        The z range of the analytical surface, calculated when not yet known.
+        """
+        
+        if self.z_range is None:
+            self.geosurface_XYZ()
+        if self.z_range is None:
+            self.z_range = self.analytical_z_range()
+            
+        return self.z_range
+    
+    
+    def analytical_z_range( self ):
+        """
+        Calculates the z range of the analytical surface, tile by tile.
+        """
+        
+        z_min, z_max = np.inf, -np.inf
+        for start_col, end_col in self.tile_bands():
+            anal_z = self.analytical_band( start_col, end_col ).Z
+            z_min, z_max = min( z_min, anal_z.min() ), max( z_max, anal_z.max() )
+            
+        return z_min, z_max
+    
+    
     def geosurface_XYZ( self ):
 
-        geosurface_X = []; geosurface_Y = []; geosurface_Z = []
-        for x, y, z in zip( self.X, self.Y, self.Z ):        
-            pt =  self.transform_loc( x, y, z )
-            geosurface_X.append( pt[0] )
-            geosurface_Y.append( pt[1] )
-            geosurface_Z.append( pt[2] )
+        if self.geosurface is None:
+            if self.is_out_of_core():
+                self.geosurface = GridSurface.memmap( self.memmap_filepath, self.grid_dims(), self.dtype )
+            else:
+                self.geosurface = GridSurface.empty( self.grid_dims(), self.dtype )
+            self.calculate_geosurface()
             
-        return geosurface_X, geosurface_Y, geosurface_Z 
-        
+        return self.geosurface 
     
-    def get_analytical_param_values( self ):
     
-        try:       
-            a_min = float( self.analytical_params['a min'] ) 
-            a_max = float( self.analytical_params['a max'] )      
-            grid_cols = int( self.analytical_params['grid cols'] )                                       
-                   
-            b_min = float( self.analytical_params['b min'] )      
-            b_max = float( self.analytical_params['b max'] )
-            grid_rows = int( self.analytical_params['grid rows'] ) 
+    def calculate_geosurface( self ):
+        """
+        Calculates the georeferenced and deformed surface from the analytical surface, tile by tile. 
+        When the analytical surface is not kept in memory (e.g., out-of-core), 
+        it is evaluated for each tile, so that memory use is bounded by the tile size.
+        """
+        
+        if self.is_out_of_core() and self.workers > 1:
+            self.geosurface.flush()
+            self.z_range = calculate_surface_bands( self.analytical_params, 
+                                                    self.transformation_matrix, 
+                                                    self.memmap_filepath, 
+                                                    self.tile_bands(), 
+                                                    self.workers,
+                                                    self.dtype )
+            return
+        
+        z_min, z_max = np.inf, -np.inf
+        for start_col, end_col in self.tile_bands():
+            if self.has_analytical_surface():
+                anal_xyz = self.analytical_surface.column_band( start_col, end_col ).xyz
+            else:
+                anal_xyz = self.analytical_band( start_col, end_col ).xyz
+                z_min, z_max = min( z_min, anal_xyz[:, 2].min() ), max( z_max, anal_xyz[:, 2].max() )
+            self.transform_xyz( anal_xyz, out = self.geosurface.column_band( start_col, end_col ).xyz )
             
-            formula = str( self.analytical_params['formula'] )           
-        except:
-            raise AnaliticSurfaceIOException, "Analytical value error"                     
+        if not self.has_analytical_surface():
+            self.z_range = z_min, z_max
+            self.geosurface.flush()
     
-        if a_min >= a_max or b_min >= b_max:
-            raise AnaliticSurfaceIOException, "Input a and b value error" 
     
-        if grid_cols <= 0 or grid_rows <= 0:
-            raise AnaliticSurfaceIOException, "Grid column/row value error"                 
+    def geosurface_bands( self ):
+        """
+        Iterates over the georeferenced and deformed surface, tile by tile, as bands of grid columns. 
+        When the surface is not yet calculated, each band is calculated on demand and not stored.
+        Memory use is then bounded by the tile size only out-of-core: otherwise the analytical surface 
+        is kept whole in memory (see the surf_io geosurface_stream_* functions).
         
-        if formula == '':
-            raise AnaliticSurfaceIOException, "Input analytical formula error"
+        @return: generator of GridSurface.
+        """
         
-        return (a_min,a_max,b_min,b_max), (grid_rows,grid_cols), formula      
+        for start_col, end_col in self.tile_bands():
+            if self.geosurface is not None:
+                yield self.geosurface.column_band( start_col, end_col )
+                continue
+            if self.analytical_surface is None:
+                anal_xyz = self.analytical_band( start_col, end_col ).xyz
+            else:
+                anal_xyz = self.analytical_surface.column_band( start_col, end_col ).xyz
+            band = GridSurface.empty( ( len( self.b_array ), end_col - start_col ), self.dtype )
+            self.transform_xyz( anal_xyz, out = band.xyz )
+            yield band
+    
+    
+    def add_deformation( self, deform_param ):
+        """
+        Appends a deformation to the deformation history, applying it
+        only to the current deformed surface, without recalculating it from the analytical formula.
+        
+        @return: the updated geosurface - GridSurface.
+        """
+        
+        try:
+            deformation = deformation_matrices( [ deform_param ] )[ 0 ]
+        except ( KeyError, TypeError, ValueError, UnboundLocalError ):
+            raise AnaliticSurfaceCalcException, "Deformation parameter error"
+        
+        deformation_matrix = deformation_homogeneous_matrix( deformation )
+        
+        geosurface = self.geosurface_XYZ()
+        for start_col, end_col in self.tile_bands():
+            band_xyz = geosurface.column_band( start_col, end_col ).xyz
+            apply_homogeneous_matrix( band_xyz, deformation_matrix, out = band_xyz )
+        geosurface.flush()
+
+        self.deformational_params.append( deform_param )
+        self.deformations.append( deformation )
+        self.transformation_matrix = np.dot( deformation_matrix, self.transformation_matrix )
+        
+        self.history.push( deform_param, deformation_matrix, geosurface.xyz if self.has_analytical_surface() else None )
+        
+        return geosurface
+    
+    
+    def undo_deformation( self ):
+        """
+        Reverts the last applied deformation.
+        
+        @return: the updated geosurface - GridSurface.
+        """
+        
+        if not self.history.can_undo():
+            raise AnaliticSurfaceCalcException, "No deformation to undo"
+        
+        geosurface = self.geosurface_XYZ()
+        self.set_history_state( self.history.undo( calculate_state = self.has_analytical_surface() ) )
+        
+        return geosurface
+
+
+    def redo_deformation( self ):
+        """
+        Re-applies the last reverted deformation.
+        
+        @return: the updated geosurface - GridSurface.
+        """
+        
+        if not self.history.can_redo():
+            raise AnaliticSurfaceCalcException, "No deformation to redo"
+        
+        geosurface = self.geosurface_XYZ()
+        self.set_history_state( self.history.redo( calculate_state = self.has_analytical_surface() ) )
+        
+        return geosurface
+    
+    
+    def set_history_state( self, state_xyz ):
+        """
+        Updates the deformation parameters, matrices and surface to the current history state.
+        When the analytical surface is not kept in memory, the surface is recalculated tile by tile.
+        """
+        
+        self.deformational_params = self.history.deform_params()
+        self.deformations = deformation_matrices( self.deformational_params )
+        self.transformation_matrix = self.history.state_matrix()
+        
+        if state_xyz is None:
+            self.calculate_geosurface()
+        else:
+            self.geosurface.xyz[:] = state_xyz
+        
+    
+    def get_analytical_param_values( self ):
+    
+        return analytical_param_values( self.analytical_params )      
     
     
     def get_geographical_param_values( self ):
@@ -1956,15 +2460,243 @@ class AnalyticGeosurface( object ):
     
     def transform_loc(self,  x, y, z ):
     
-        pt = np.dot( self.geographic_transformation_matrix, np.array([x,y,z]) ) + self.geographic_offset_matrix
-        for deformation in self.deformations:
-            if deformation['increment'] == 'additive':
-                pt = pt + deformation['matrix']
-            elif deformation['increment'] == 'multiplicative':
-                pt = pt - deformation['shift_pt']
-                pt = np.dot( deformation['matrix'], pt )
-                pt = pt + deformation['shift_pt']                
-        return pt  
+        return self.transform_xyz( np.array( [ [ x, y, z ] ] ) )[ 0 ]  
+
+
+    def transform_xyz( self, xyz_array, out = None ):
+        """
+        Applies the georeferencing and the deformations to an (n, 3) array of analytical points.
+        """
+        
+        return apply_homogeneous_matrix( xyz_array, self.transformation_matrix, out )
+
+
+def analytical_param_values( analytical_params ):
+
+    try:       
+        a_min = float( analytical_params['a min'] ) 
+        a_max = float( analytical_params['a max'] )      
+        grid_cols = int( analytical_params['grid cols'] )                                       
+               
+        b_min = float( analytical_params['b min'] )      
+        b_max = float( analytical_params['b max'] )
+        grid_rows = int( analytical_params['grid rows'] ) 
+        
+        formula = str( analytical_params['formula'] )           
+    except:
+        raise AnaliticSurfaceIOException, "Analytical value error"                     
+
+    if a_min >= a_max or b_min >= b_max:
+        raise AnaliticSurfaceIOException, "Input a and b value error" 
+
+    if grid_cols <= 0 or grid_rows <= 0:
+        raise AnaliticSurfaceIOException, "Grid column/row value error"                 
+    
+    if formula == '':
+        raise AnaliticSurfaceIOException, "Input analytical formula error"
+    
+    return (a_min,a_max,b_min,b_max), (grid_rows,grid_cols), formula
+
+
+def analytical_grid_surface( formula, a_array, b_array, dtype = float ):
+    """
+    Calculates the analytical surface from the formula, for the grid defined by the a and b values.
+    
+    @return: GridSurface.
+    """
+    
+    a_grid, b_grid, z_grid = formula_to_arrays( formula, a_array, b_array, dtype )
+    
+    return GridSurface.from_arrays( a_grid, b_grid, z_grid, ( len( b_array ), len( a_array ) ), dtype )
+
+
+def calculate_surface_band( band_params ):
+    """
+    Calculates a band of grid columns of an analytical surface, optionally transformed 
+    by a homogeneous matrix, and writes it into a memory-mapped surface file,
+    and optionally also the analytical band into a second memory-mapped file.
+    Used by the process pool workers: only the (small) parameters are passed between processes.
+    
+    @param band_params: analytical parameters, 4x4 transformation matrix (or None), 
+                        memory-mapped file path, analytical surface memory-mapped file path (or None),
+                        float type, ( start column, end column ).
+    @type band_params: tuple.
+    
+    @return: the z range of the analytical band - tuple of two floats.
+    """
+    
+    analytical_params, transformation_matrix, memmap_filepath, analytical_filepath, dtype, ( start_col, end_col ) = band_params
+    
+    array_range, array_size, formula = analytical_param_values( analytical_params )
+    a_array, b_array = grid_axes( array_range, array_size, dtype )
+    
+    anal_xyz = analytical_grid_surface( formula, a_array[ start_col:end_col ], b_array, dtype ).xyz
+    
+    surface = GridSurface.memmap( memmap_filepath, array_size, dtype, mode = 'r+' )
+    band_xyz = surface.column_band( start_col, end_col ).xyz
+    if transformation_matrix is None:
+        band_xyz[:] = anal_xyz
+    else:
+        apply_homogeneous_matrix( anal_xyz, transformation_matrix, out = band_xyz )
+    surface.flush()
+    
+    if analytical_filepath is not None:
+        analytical_surface = GridSurface.memmap( analytical_filepath, array_size, dtype, mode = 'r+' )
+        analytical_surface.column_band( start_col, end_col ).xyz[:] = anal_xyz
+        analytical_surface.flush()
+    
+    return anal_xyz[:, 2].min(), anal_xyz[:, 2].max()
+    
+
+def calculate_surface_bands( analytical_params, transformation_matrix, memmap_filepath, bands, workers, dtype = float,
+                             analytical_filepath = None ):
+    """
+    Calculates the bands of an analytical surface into a memory-mapped surface file
+    (and, when analytical_filepath is defined, also the untransformed bands into a second one),
+    using a pool of worker processes. 
+    Results are identical to those of the serial calculation.
+    
+    @return: the z range of the analytical surface - tuple of two floats.
+    """
+    
+    import multiprocessing
+    
+    pool = multiprocessing.Pool( processes = workers )
+    try:
+        z_ranges = pool.map( calculate_surface_band, 
+                             [ ( analytical_params, transformation_matrix, memmap_filepath, analytical_filepath, dtype, band ) 
+                               for band in bands ],
+                             chunksize = 1 )
+    finally:
+        pool.close()
+        pool.join()
+        
+    z_mins, z_maxs = zip( *z_ranges )
+        
+    return min( z_mins ), max( z_maxs )
+
+
+def transform_xyz( xyz_array, transformation_matrix, offset_matrix, deformations = [] ):
+    """
+    Transforms an (n, 3) array of points, applying the transformation matrix and offset 
+    and then the deformations, pre-composed into a single homogeneous matrix.
+    
+    @return: numpy.array, shape (n, 3).
+    """
+    
+    return apply_homogeneous_matrix( xyz_array, 
+                                     compose_transformation( transformation_matrix, offset_matrix, deformations ) )
+
+
+def homogeneous_matrix( matrix = None, offset = None ):
+    """
+    Creates the 4x4 homogeneous matrix of an affine transformation,
+    given its 3x3 matrix (default: identity) and its offset vector (default: null).
+    """
+    
+    homog_matrix = np.identity( 4 )
+    if matrix is not None:
+        homog_matrix[ :3, :3 ] = matrix
+    if offset is not None:
+        homog_matrix[ :3, 3 ] = offset
+    
+    return homog_matrix
+
+
+def deformation_homogeneous_matrix( deformation ):
+    """
+    Converts a deformation (as created by deformation_matrices) into a 4x4 homogeneous matrix.
+    Multiplicative deformations are centered on their shift point.
+    """
+    
+    if deformation['increment'] == 'additive':
+        return homogeneous_matrix( offset = deformation['matrix'] )
+    elif deformation['increment'] == 'multiplicative':
+        shift_pt = deformation['shift_pt']
+        return homogeneous_matrix( deformation['matrix'], 
+                                   shift_pt - np.dot( deformation['matrix'], shift_pt ) )
+    
+
+def compose_transformation( transformation_matrix, offset_matrix, deformations = [] ):
+    """
+    Composes the georeferencing transformation and the sequence of deformations
+    into a single 4x4 homogeneous matrix.
+    """
+    
+    total_matrix = homogeneous_matrix( transformation_matrix, offset_matrix )
+    for deformation in deformations:
+        total_matrix = np.dot( deformation_homogeneous_matrix( deformation ), total_matrix )
+        
+    return total_matrix
+
+
+def apply_homogeneous_matrix( xyz_array, homog_matrix, out = None ):
+    """
+    Applies a 4x4 homogeneous matrix to an (n, 3) array of points.
+    Each output coordinate is computed element-wise, so that results 
+    do not depend on how the points are partitioned into arrays.
+    Calculations are in double precision, whatever the float type of the points.
+    
+    @return: numpy.array, shape (n, 3), with the float type of the input points (when out is not given).
+    """
+    
+    xyz_array = np.asarray( xyz_array )
+    if out is None:
+        out = np.empty( xyz_array.shape, dtype = np.result_type( xyz_array.dtype, np.float32 ) )
+    
+    x, y, z = [ xyz_array[:, i].astype( float, copy = False ) for i in xrange( 3 ) ]
+    coords = [ homog_matrix[ i, 0 ] * x + homog_matrix[ i, 1 ] * y + homog_matrix[ i, 2 ] * z + homog_matrix[ i, 3 ] 
+               for i in xrange( 3 ) ]
+    for i in xrange( 3 ):
+        out[:, i] = coords[ i ]
+        
+    return out
+
+
+def apply_homogeneous_matrices( xyz_array, homog_matrices, out = None ):
+    """
+    Applies a stack of 4x4 homogeneous matrices to an (n, 3) array of points, in a single vectorized pass.
+    Each output coordinate is computed element-wise as in apply_homogeneous_matrix, 
+    so that the results are identical to applying the matrices one by one.
+    
+    @param homog_matrices: the homogeneous matrices, shape (k, 4, 4).
+    @type homog_matrices: numpy.array.
+    
+    @return: numpy.array, shape (k, n, 3), with the float type of the input points (when out is not given).
+    """
+    
+    xyz_array = np.asarray( xyz_array )
+    if out is None:
+        out = np.empty( ( len( homog_matrices ), ) + xyz_array.shape, dtype = np.result_type( xyz_array.dtype, np.float32 ) )
+    
+    x, y, z = [ xyz_array[:, i].astype( float, copy = False ) for i in xrange( 3 ) ]
+    matrix_values = np.asarray( homog_matrices, dtype = float )[ :, :, :, np.newaxis ]
+    for i in xrange( 3 ):
+        out[:, :, i] = matrix_values[ :, i, 0 ] * x + matrix_values[ :, i, 1 ] * y + matrix_values[ :, i, 2 ] * z + matrix_values[ :, i, 3 ]
+        
+    return out
+
+
+def geographic_transformation( array_range, geographical_values ):
+    """
+    Calculates the transformation matrix and offset from analytical to geographical coordinates.
+    
+    @return: tuple of two numpy.array: the 3x3 transformation matrix and the offset vector.
+    """
+    
+    a_min, a_max, b_min, b_max = array_range
+    (geog_x_min, geog_y_min), (area_height, area_width), area_rot_ang_deg = geographical_values
+    
+    geog_scale_matr = geographic_scale_matrix( a_max - a_min, b_max - b_min, area_height, area_width )
+    geogr_rot_matrix = geographic_rotation_matrix( area_rot_ang_deg )
+
+    transformation_matrix = np.dot( geogr_rot_matrix, geog_scale_matr )
+
+    offset_matrix = geographic_offset( transformation_matrix, 
+                                       np.array( [a_min, b_min, 0.0] ),
+                                       np.array( [geog_x_min, geog_y_min, 0.0] ) )
+    
+    return transformation_matrix, offset_matrix
 
 
 def geographic_scale_matrix( a_range, b_range, grid_height, grid_width ):
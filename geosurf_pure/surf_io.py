@@ -6,25 +6,60 @@ from __future__  import division
 import os
 import numpy as np
 import json
+import zlib
+import gzip
+import tempfile
+import itertools
 
 
-from .spatial import Grid, Point3D
+from .spatial import Grid, Point3D, GridSurface, AnalyticGeosurface, as_grid_surface, column_bands
+from .array_utils import format_array_rows
+from .topology import band_triangles, column_triangles, column_triangle_strips
 from .errors import RasterParametersException, OGRIOException, AnaliticSurfaceIOException
 
 
+EXPORT_CHUNK_SIZE = 3 * 65536 # number of values formatted for each write call
+
+VTP_BLOCK_SIZE = 1024 * 1024 # uncompressed bytes of each zlib-compressed block of the VTK XML appended data
+
+XYZ_DECIMALS = 4
+XYZ_GZIP_LEVEL = 1 # fastest compression: higher levels shrink the text point clouds only slightly more
+
+CELL_SIZE_DIGITS = 12 # significant digits of the raster cell sizes written in the ESRI headers
+
+GAS_CONTAINER_MAGIC = 'GASBIN01'
+GAS_CONTAINER_ALIGNMENT = 64 # bytes
+GAS_CONTAINER_TEMP_SUFFIX = '.tmp' # suffix of the containers being written
+
    
-def geosurface_export_vtk( output_filepath, geodata ):
+def geosurface_export_vtk( output_filepath, geodata, dtype = float ):
 
     geosurface_XYZ, grid_dims = geodata
-    X, Y, Z = geosurface_XYZ
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_vtk( output_filepath, export_bands( geosurface ), grid_dims )
     
-    X_arr = np.array(X, dtype=float)
-    Y_arr = np.array(Y, dtype=float)
-    Z_arr = np.array(Z, dtype=float)
-
-    n_points = np.size( X_arr )
     
+def geosurface_stream_vtk( output_filepath, surface_bands, grid_dims ):
+    """
+    Saves in the VTK format a surface provided as a sequence of bands of grid columns
+    (e.g., AnalyticGeosurface.geosurface_bands), writing each band as soon as it is available.
+    
+    The memory used by all the geosurface_stream_* functions is bounded by the band size 
+    only when the source does not keep the surface in memory, i.e. for an out-of-core 
+    AnalyticGeosurface (memmap_filepath defined). For an in-memory AnalyticGeosurface, 
+    the whole analytical surface is kept in memory, as well as the whole transformed surface 
+    once it has been calculated (e.g., by geosurface_XYZ, or at creation with workers > 1), 
+    and the bands are views of it; the geosurface_export_* functions always save 
+    an already calculated surface.
+    
+    @param surface_bands: the consecutive bands of grid columns of the surface.
+    @type surface_bands: iterable of GridSurface.
+    """
+
     n_rows, n_cols = grid_dims        
+    
+    n_points = n_rows * n_cols
                       
     with open( output_filepath, 'w' ) as outfile:
     
@@ -34,94 +69,496 @@ def geosurface_export_vtk( output_filepath, geodata ):
         outfile.write( '\nDATASET POLYDATA\n' )
         
         outfile.write( 'POINTS %d float\n' % n_points )
-        for n in xrange( n_points ):
-            outfile.write( '%.4f %.4f %.4f\n' % ( X_arr[n], Y_arr[n], Z_arr[n] ) )
+        for band in surface_bands:
+            write_array_rows( outfile, band.xyz, 4, ( ' ', ' ', '\n' ) )
         
         outfile.write( '\n' )      
         
         outfile.write( 'TRIANGLE_STRIPS %d %d\n' % ( n_cols-1, (n_cols-1)*(1+n_rows*2) ) )
     
-        num_points_strip = n_rows * 2   
-        for l in xrange( n_cols - 1 ):
-            triangle_strip_string = "%d " % num_points_strip
-            for p in xrange( n_rows ):            
-                triangle_strip_string += "%d %d " % ( (l+1)*n_rows+p, l*n_rows+p )
-            triangle_strip_string += "\n" 
-            outfile.write( triangle_strip_string ) 
+        num_points_strip = n_rows * 2
+        for start_col, end_col in column_bands( n_cols - 1, max( 1, EXPORT_CHUNK_SIZE // num_points_strip ) ):
+            strips = column_triangle_strips( grid_dims, start_col, end_col )
+            write_array_rows( outfile, 
+                              np.column_stack( ( np.full( len( strips ), num_points_strip, dtype = strips.dtype ), strips ) ),
+                              0,
+                              [ ' ' ] * num_points_strip + [ ' \n' ] )
             
     return True     
     
+    
+def geosurface_export_vtk_binary( output_filepath, geodata, dtype = float ):
+    """
+    Saves the geosurface in the legacy VTK format, with big-endian binary data.
+    Coordinates are written with the float type of the surface (float or double).
+    """
+
+    geosurface_XYZ, grid_dims = geodata
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+
+    n_points = geosurface.num_nodes
+    
+    n_rows, n_cols = grid_dims
+    
+    points_dtype = geosurface.dtype.newbyteorder( '>' )
+    points_type = 'float' if geosurface.dtype.itemsize == 4 else 'double'
+                      
+    with open( output_filepath, 'wb' ) as outfile:
+    
+        outfile.write( '# vtk DataFile Version 2.0\n' )
+        outfile.write( 'Geosurface - qgSurf vers. 0.3.0\n' ) 
+        outfile.write( 'BINARY\n' )   
+        outfile.write( '\nDATASET POLYDATA\n' )
+        
+        outfile.write( 'POINTS %d %s\n' % ( n_points, points_type ) )
+        chunk_points = EXPORT_CHUNK_SIZE // 3
+        for start_ndx in xrange( 0, n_points, chunk_points ):
+            outfile.write( geosurface.xyz[ start_ndx:start_ndx + chunk_points ].astype( points_dtype ).tostring() )
+        
+        outfile.write( '\n' )      
+        
+        outfile.write( 'TRIANGLE_STRIPS %d %d\n' % ( n_cols-1, (n_cols-1)*(1+n_rows*2) ) )
+    
+        num_points_strip = n_rows * 2
+        for start_col, end_col in column_bands( n_cols - 1, max( 1, EXPORT_CHUNK_SIZE // num_points_strip ) ):
+            strips = column_triangle_strips( grid_dims, start_col, end_col )
+            outfile.write( np.column_stack( ( np.full( len( strips ), num_points_strip, dtype = strips.dtype ), 
+                                              strips ) ).astype( '>i4' ).tostring() )
+        
+        outfile.write( '\n' )
             
-def geosurface_export_grass( output_filepath, geodata ):
-    # Save in Grass format
+    return True     
+
+
+def geosurface_export_vtp( output_filepath, geodata, dtype = float, compression = True ):
+    """
+    Saves the geosurface in the VTK XML PolyData format (.vtp), 
+    with raw appended data, optionally compressed with zlib.
+    The data arrays are streamed in chunks: the XML header is written first,
+    with fixed-width offsets that are patched once the appended data are written.
+    """
 
     geosurface_XYZ, grid_dims = geodata
-    X, Y, Z = geosurface_XYZ
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
 
-    X_arr = np.array(X, dtype=float)
-    Y_arr = np.array(Y, dtype=float)
-    Z_arr = np.array(Z, dtype=float)
+    n_rows, n_cols = grid_dims
+    
+    num_points_strip = n_rows * 2
+    strip_bands = column_bands( n_cols - 1, max( 1, EXPORT_CHUNK_SIZE // num_points_strip ) )
+    
+    # name, values type, number of values, chunks of values
+    data_arrays = [ ( 'Points', geosurface.dtype, geosurface.num_nodes * 3, 
+                      ( band.xyz for band in export_bands( geosurface ) ) ),
+                    ( 'connectivity', np.dtype( np.int64 ), ( n_cols - 1 ) * num_points_strip, 
+                      ( column_triangle_strips( grid_dims, start_col, end_col ) for start_col, end_col in strip_bands ) ),
+                    ( 'offsets', np.dtype( np.int64 ), n_cols - 1, 
+                      ( np.arange( start_col + 1, end_col + 1, dtype = np.int64 ) * num_points_strip 
+                        for start_col, end_col in strip_bands ) ) ]
+    
+    data_types = [ values_dtype for _, values_dtype, _, _ in data_arrays ]
+    
+    with open( output_filepath, 'wb' ) as outfile:
+        
+        outfile.write( vtp_xml_header( geosurface.num_nodes, n_cols - 1, data_types, [ 0 ] * len( data_arrays ), compression ) )
+        outfile.write( '  <AppendedData encoding="raw">\n' )
+        outfile.write( '   _' )
+        
+        data_start = outfile.tell()
+        data_offsets = []
+        for _, values_dtype, n_values, value_chunks in data_arrays:
+            data_offsets.append( outfile.tell() - data_start )
+            write_vtp_appended_data( outfile, value_chunks, n_values, values_dtype, compression )
+            
+        outfile.write( '\n  </AppendedData>\n' )
+        outfile.write( '</VTKFile>\n' )
+        
+        outfile.seek( 0 )
+        outfile.write( vtp_xml_header( geosurface.num_nodes, n_cols - 1, data_types, data_offsets, compression ) )
+        
+    return True
+
+
+VTP_DATA_TYPES = { 'f4': 'Float32', 'f8': 'Float64', 'i4': 'Int32', 'i8': 'Int64' }
+
+VTP_ARRAY_NAMES = ( 'Points', 'connectivity', 'offsets' )
+
+
+def vtp_xml_header( n_points, n_strips, data_types, data_offsets, compression ):
+    """
+    XML header of a VTK PolyData file with triangle strips and appended data.
+    The offsets are written with a fixed width, so that the header can be rewritten 
+    in place once the offsets of the appended data are known.
+    """
+
+    data_array_tags = [ '<DataArray type="%s" Name="%s"%s format="appended" offset="%20d"/>' % ( 
+                            VTP_DATA_TYPES[ values_dtype.str[1:] ], 
+                            name, 
+                            ' NumberOfComponents="3"' if name == 'Points' else '', 
+                            data_offset ) 
+                        for name, values_dtype, data_offset in zip( VTP_ARRAY_NAMES, data_types, data_offsets ) ]
+    
+    return ''.join( [ '<?xml version="1.0"?>\n',
+                      '<VTKFile type="PolyData" version="1.0" byte_order="LittleEndian" header_type="UInt64"%s>\n' %
+                          ( ' compressor="vtkZLibDataCompressor"' if compression else '' ),
+                      '  <PolyData>\n',
+                      '    <Piece NumberOfPoints="%d" NumberOfVerts="0" NumberOfLines="0" NumberOfStrips="%d" NumberOfPolys="0">\n' % 
+                          ( n_points, n_strips ),
+                      '      <Points>\n',
+                      '        %s\n' % data_array_tags[0],
+                      '      </Points>\n',
+                      '      <Strips>\n',
+                      '        %s\n' % data_array_tags[1],
+                      '        %s\n' % data_array_tags[2],
+                      '      </Strips>\n',
+                      '    </Piece>\n',
+                      '  </PolyData>\n' ] )
+
+
+def write_vtp_appended_data( outfile, value_chunks, n_values, values_dtype, compression, block_size = VTP_BLOCK_SIZE ):
+    """
+    Writes the raw appended data of an array in the VTK XML format, with UInt64 headers,
+    from the consecutive chunks of its values. When compressed, the data are split into blocks 
+    compressed with zlib: the header is reserved first, and then rewritten with the block sizes.
+    
+    @param n_values: the total number of values of the chunks.
+    @type n_values: int.
+    
+    @return: the size in bytes of the appended data.
+    """
+    
+    values_dtype = np.dtype( values_dtype ).newbyteorder( '<' )
+    n_bytes = n_values * values_dtype.itemsize
+    
+    start_pos = outfile.tell()
     
-    n_rows, n_cols = grid_dims   
+    if not compression:
+        outfile.write( np.array( [ n_bytes ], dtype = '<u8' ).tostring() )
+        for values in value_chunks:
+            outfile.write( values.astype( values_dtype ).tostring() )
+        return outfile.tell() - start_pos
+    
+    block_bytes = max( 1, block_size // values_dtype.itemsize ) * values_dtype.itemsize
+    n_blocks = -( -n_bytes // block_bytes )
+    last_block_size = n_bytes - ( n_blocks - 1 ) * block_bytes if n_blocks > 0 else 0
+    
+    header = np.zeros( 3 + n_blocks, dtype = '<u8' )
+    header[ :3 ] = n_blocks, block_bytes, last_block_size
+    outfile.write( header.tostring() )
+    
+    block_ndx = 0
+    pending_data = ''
+    for values in itertools.chain( value_chunks, [ None ] ):
+        if values is None: # last, partial block
+            data, n_full_bytes = pending_data, len( pending_data )
+        else:
+            data = pending_data + values.astype( values_dtype ).tostring()
+            n_full_bytes = len( data ) - len( data ) % block_bytes
+        for block_start in xrange( 0, n_full_bytes, block_bytes ):
+            compressed_block = zlib.compress( data[ block_start:block_start + block_bytes ] )
+            header[ 3 + block_ndx ] = len( compressed_block )
+            block_ndx += 1
+            outfile.write( compressed_block )
+        pending_data = data[ n_full_bytes: ]
+    
+    assert block_ndx == n_blocks
+    
+    end_pos = outfile.tell()
+    outfile.seek( start_pos )
+    outfile.write( header.tostring() )
+    outfile.seek( end_pos )
+    
+    return end_pos - start_pos
+    
+    
+def write_array_rows( outfile, values_array, decimals, suffixes, chunk_size = EXPORT_CHUNK_SIZE ):
+    """
+    Writes the rows of a 2D array as text (see format_array_rows),
+    formatting and writing about chunk_size values at a time.
+    """
+    
+    n_rows, n_values = values_array.shape
+    chunk_rows = max( 1, chunk_size // max( 1, n_values ) )
+    
+    for start_row in xrange( 0, n_rows, chunk_rows ):
+        outfile.write( format_array_rows( values_array[ start_row:start_row + chunk_rows ], decimals, suffixes ) )
+    
+            
+def geosurface_export_grass( output_filepath, geodata, dtype = float ):
+    # Save in Grass format
+
+    geosurface_XYZ, grid_dims = geodata
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_grass( output_filepath, export_bands( geosurface ), grid_dims )
+    
+    
+def geosurface_stream_grass( output_filepath, surface_bands, grid_dims ):
+    """
+    Saves in the Grass format a surface provided as a sequence of bands of grid columns
+    (see geosurface_stream_vtk).
+    """
                             
     with open( output_filepath, 'w' ) as outfile:
         outfile.write( 'VERTI:\n' ) 
-        for l in xrange( n_cols - 1 ):
-            for p in xrange( n_rows - 1 ):
-                start_point_ndx = l*n_rows + p
-                forward_line_point_ndx = start_point_ndx + n_rows
-                outfile.write('F 4\n')
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx], Y_arr[start_point_ndx], Z_arr[start_point_ndx] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx+1], Y_arr[start_point_ndx+1], Z_arr[start_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) )        
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx], Y_arr[start_point_ndx], Z_arr[start_point_ndx] ) )            
-                outfile.write('F 4\n')
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) ) 
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx+1], Y_arr[start_point_ndx+1], Z_arr[start_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx+1], Y_arr[forward_line_point_ndx+1], Z_arr[forward_line_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) ) 
+        for vertices, triangles in band_faces( surface_bands, grid_dims ):
+            face_strings = np.empty( ( len( triangles ), 5 ), dtype = object )
+            face_strings[ :, 0 ] = 'F 4\n'
+            face_strings[ :, 1:4 ] = vertices[ triangles ]
+            face_strings[ :, 4 ] = face_strings[ :, 1 ]
+            outfile.write( ''.join( face_strings.ravel().tolist() ) )
 
     return True 
 
 
-def geosurface_export_esri_generate( output_filepath, geodata ):
+def geosurface_export_esri_generate( output_filepath, geodata, dtype = float ):
     # Save geosurface (GAS) in Esri generate  format
 
     geosurface_XYZ, grid_dims = geodata
-    X, Y, Z = geosurface_XYZ
-
-    X_arr = np.array(X, dtype=float)
-    Y_arr = np.array(Y, dtype=float)
-    Z_arr = np.array(Z, dtype=float)
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_esri_generate( output_filepath, export_bands( geosurface ), grid_dims )
+    
     
-    n_rows, n_cols = grid_dims   
+def geosurface_stream_esri_generate( output_filepath, surface_bands, grid_dims ):
+    """
+    Saves in the Esri generate format a surface provided as a sequence of bands of grid columns
+    (see geosurface_stream_vtk).
+    """
       
     progr_id = 0                      
     with open( output_filepath, 'w' ) as outfile:
         outfile.write( 'VERTI:\n' ) 
-        for l in xrange( n_cols - 1 ):
-            for p in xrange( n_rows - 1 ):
-                start_point_ndx = l*n_rows + p
-                forward_line_point_ndx = start_point_ndx + n_rows
-                progr_id += 1
-                outfile.write('%d\n' % progr_id)
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx], Y_arr[start_point_ndx], Z_arr[start_point_ndx] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx+1], Y_arr[start_point_ndx+1], Z_arr[start_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) )        
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx], Y_arr[start_point_ndx], Z_arr[start_point_ndx] ) ) 
-                outfile.write( 'END\n' )                
-                progr_id += 1
-                outfile.write('%d\n' % progr_id)
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) ) 
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[start_point_ndx+1], Y_arr[start_point_ndx+1], Z_arr[start_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx+1], Y_arr[forward_line_point_ndx+1], Z_arr[forward_line_point_ndx+1] ) )
-                outfile.write(' %.4f %.4f %.4f\n' % ( X_arr[forward_line_point_ndx], Y_arr[forward_line_point_ndx], Z_arr[forward_line_point_ndx] ) )
-                outfile.write( 'END\n' )    
+        for vertices, triangles in band_faces( surface_bands, grid_dims ):
+            face_ids = np.arange( progr_id + 1, progr_id + len( triangles ) + 1 )
+            progr_id += len( triangles )
+            face_strings = np.empty( ( len( triangles ), 6 ), dtype = object )
+            face_strings[ :, 0 ] = format_array_rows( face_ids[ :, np.newaxis ], 0, [ '\n' ] ).splitlines( True )
+            face_strings[ :, 1:4 ] = vertices[ triangles ]
+            face_strings[ :, 4 ] = face_strings[ :, 1 ]
+            face_strings[ :, 5 ] = 'END\n'
+            outfile.write( ''.join( face_strings.ravel().tolist() ) )
         outfile.write( 'END\n' )                   
 
     return True 
 
-                
+
+def export_bands( geosurface ):
+    """
+    Bands of grid columns used to export a surface, of about EXPORT_CHUNK_SIZE values each.
+    """
+    
+    grid_rows, _ = geosurface.grid_dims
+    
+    return geosurface.column_bands( max( 1, EXPORT_CHUNK_SIZE // ( 3 * grid_rows ) ) )
+
+
+def vertex_strings( geosurface ):
+    """
+    Formats once all the vertices of a surface, as used by the GRASS and Generate formats.
+    
+    @return: numpy.array of strings (' x y z\\n'), one for each vertex.
+    """
+    
+    vertices = np.empty( geosurface.num_nodes, dtype = object )
+    chunk_points = EXPORT_CHUNK_SIZE // 3
+    for start_ndx in xrange( 0, geosurface.num_nodes, chunk_points ):
+        xyz_text = format_array_rows( geosurface.xyz[ start_ndx:start_ndx + chunk_points ], 4, ( ' ', ' ', '\n' ) )
+        vertices[ start_ndx:start_ndx + chunk_points ] = [ ' ' + line for line in xyz_text.splitlines( True ) ]
+    
+    return vertices
+
+
+def band_faces( surface_bands, grid_dims, band_vertices = vertex_strings, chunk_size = EXPORT_CHUNK_SIZE // 3 ):
+    """
+    Iterates over the triangular faces of a surface provided as a sequence of bands of grid columns.
+    The vertices of the last column of each band are kept for the faces 
+    between it and the first column of the following band.
+    
+    @param band_vertices: function creating the vertex array of a band (default: vertex strings).
+    @type band_vertices: function.
+    
+    @return: tuples of band vertices and of chunks of triangles, 
+             with indices referred to the band vertices.
+    """
+    
+    n_rows, _ = grid_dims
+    
+    start_col = 0
+    previous_vertices = None
+    for band in surface_bands:
+        _, band_cols = band.grid_dims
+        vertices = band_vertices( band )
+        if previous_vertices is None:
+            first_col = start_col
+        else:
+            vertices = np.concatenate( ( previous_vertices, vertices ) )
+            first_col = start_col - 1
+        end_col = start_col + band_cols
+        
+        triangles = band_triangles( ( n_rows, end_col - 1 - first_col ) )
+        for start_ndx in xrange( 0, len( triangles ), chunk_size ):
+            yield vertices, triangles[ start_ndx:start_ndx + chunk_size ]
+            
+        previous_vertices = vertices[ -n_rows: ]
+        start_col = end_col
+
+
+def geosurface_export_ply( output_filepath, geodata, dtype = float ):
+    """
+    Saves the geosurface in the binary (little-endian) PLY format, 
+    with the vertex table followed by the triangular faces.
+    """
+
+    geosurface_XYZ, grid_dims = geodata
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_ply( output_filepath, export_bands( geosurface ), grid_dims, geosurface.dtype )
+
+
+def geosurface_stream_ply( output_filepath, surface_bands, grid_dims, dtype = float ):
+    """
+    Saves in the binary PLY format a surface provided as a sequence of bands of grid columns
+    (see geosurface_stream_vtk), with the given float type.
+    """
+    
+    n_rows, n_cols = grid_dims
+    
+    points_dtype = np.dtype( dtype ).newbyteorder( '<' )
+    points_type = 'float' if points_dtype.itemsize == 4 else 'double'
+    n_triangles = 2 * ( n_rows - 1 ) * ( n_cols - 1 )
+    
+    with open( output_filepath, 'wb' ) as outfile:
+        
+        outfile.write( 'ply\n' )
+        outfile.write( 'format binary_little_endian 1.0\n' )
+        outfile.write( 'comment Geosurface - qgSurf vers. 0.3.0\n' )
+        outfile.write( 'element vertex %d\n' % ( n_rows * n_cols ) )
+        for coord in ( 'x', 'y', 'z' ):
+            outfile.write( 'property %s %s\n' % ( points_type, coord ) )
+        outfile.write( 'element face %d\n' % n_triangles )
+        outfile.write( 'property list uchar int vertex_indices\n' )
+        outfile.write( 'end_header\n' )
+        
+        for band in surface_bands:
+            band.xyz.astype( points_dtype ).tofile( outfile )
+            
+        for start_col, end_col in column_bands( n_cols - 1, max( 1, ( EXPORT_CHUNK_SIZE // 3 ) // ( 2 * n_rows ) ) ):
+            triangles = column_triangles( grid_dims, start_col, end_col )
+            faces = np.empty( len( triangles ), dtype = PLY_FACE_DTYPE )
+            faces[ 'n_vertices' ] = 3
+            faces[ 'vertex_indices' ] = triangles
+            faces.tofile( outfile )
+        
+    return True
+
+
+PLY_FACE_DTYPE = np.dtype( [ ( 'n_vertices', 'u1' ), ( 'vertex_indices', '<i4', 3 ) ] )
+
+
+def geosurface_export_stl( output_filepath, geodata, dtype = float ):
+    """
+    Saves the geosurface in the binary STL format, 
+    with single-precision facet normals and vertices.
+    """
+
+    geosurface_XYZ, grid_dims = geodata
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_stl( output_filepath, export_bands( geosurface ), grid_dims )
+
+
+def geosurface_stream_stl( output_filepath, surface_bands, grid_dims ):
+    """
+    Saves in the binary STL format a surface provided as a sequence of bands of grid columns
+    (see geosurface_stream_vtk).
+    """
+    
+    n_rows, n_cols = grid_dims
+    
+    n_triangles = 2 * ( n_rows - 1 ) * ( n_cols - 1 )
+    
+    with open( output_filepath, 'wb' ) as outfile:
+        
+        outfile.write( 'Geosurface - qgSurf vers. 0.3.0'.ljust( 80 ) )
+        np.array( [ n_triangles ], dtype = '<u4' ).tofile( outfile )
+        
+        for vertices, triangles in band_faces( surface_bands, grid_dims, lambda band: band.xyz ):
+            triangle_vertices = vertices[ triangles ]
+            normals = np.cross( triangle_vertices[ :, 1 ] - triangle_vertices[ :, 0 ], 
+                                triangle_vertices[ :, 2 ] - triangle_vertices[ :, 0 ] )
+            normals_length = np.sqrt( ( normals ** 2 ).sum( axis = 1 ) )[ :, np.newaxis ]
+            facets = np.zeros( len( triangles ), dtype = STL_FACET_DTYPE )
+            facets[ 'normal' ] = np.divide( normals, normals_length, out = np.zeros( normals.shape ), where = normals_length > 0 )
+            facets[ 'vertices' ] = triangle_vertices
+            facets.tofile( outfile )
+        
+    return True
+
+
+STL_FACET_DTYPE = np.dtype( [ ( 'normal', '<f4', 3 ), ( 'vertices', '<f4', ( 3, 3 ) ), ( 'attribute', '<u2' ) ] )
+
+
+def grid_export_esri_ascii( output_filepath, grid, nodata_value = -9999, decimals = 4 ):
+    """
+    Saves a Grid (e.g., a rasterized surface) in the ESRI ASCII grid format.
+    NaN cells are saved as nodata.
+    """
+    
+    cell_size = square_cell_size( grid )
+    if cell_size is None:
+        raise RasterParametersException, "ESRI ASCII grid requires square cells"
+    
+    with open( output_filepath, 'w' ) as outfile:
+        outfile.write( esri_grid_header( grid, cell_size, nodata_value ) )
+        grid_data = np.where( np.isnan( grid.data ), nodata_value, grid.data )
+        write_array_rows( outfile, grid_data, decimals, [ ' ' ] * ( grid.col_num() - 1 ) + [ '\n' ] )
+        
+    return True
+
+
+def grid_export_float( output_filepath, grid, nodata_value = -9999 ):
+    """
+    Saves a Grid (e.g., a rasterized surface) as a raw little-endian float32 file,
+    with the ESRI header in a .hdr file with the same name.
+    NaN cells are saved as nodata.
+    """
+    
+    cell_size = square_cell_size( grid )
+    if cell_size is None:
+        raise RasterParametersException, "ESRI float grid requires square cells"
+    
+    with open( os.path.splitext( output_filepath )[0] + '.hdr', 'w' ) as headerfile:
+        headerfile.write( esri_grid_header( grid, cell_size, nodata_value ) )
+        headerfile.write( 'byteorder LSBFIRST\n' )
+    
+    with open( output_filepath, 'wb' ) as outfile:
+        np.where( np.isnan( grid.data ), nodata_value, grid.data ).astype( '<f4' ).tofile( outfile )
+        
+    return True
+
+
+def square_cell_size( grid, rel_tolerance = 1e-9 ):
+    """
+    The cell size of a grid with square cells. The x and y cell sizes are recalculated 
+    from the domain ranges, so they are compared with a relative tolerance, 
+    and their mean is rounded to CELL_SIZE_DIGITS significant digits 
+    (e.g., 0.1 instead of 0.10000000000000007).
+    
+    @return: the cell size - float, or None when the cells are not square.
+    """
+    
+    if not np.isclose( grid.cellsize_x(), grid.cellsize_y(), rtol = rel_tolerance, atol = 0 ):
+        return None
+    
+    return float( '%.*g' % ( CELL_SIZE_DIGITS, grid.cellsize_h() ) )
+
+
+def esri_grid_header( grid, cell_size, nodata_value ):
+    
+    return 'ncols %d\nnrows %d\nxllcorner %r\nyllcorner %r\ncellsize %r\nNODATA_value %r\n' % ( 
+                grid.col_num(), grid.row_num(), grid.xmin, grid.ymin, cell_size, nodata_value )
+
+
 def geosurface_save_gas( output_filepath, geodata ):
     
     with open( output_filepath, 'w' ) as outfile:
@@ -130,19 +567,157 @@ def geosurface_save_gas( output_filepath, geodata ):
     return True 
         
 
-def geosurface_export_xyz( xyz_file_path, geodata, ):
+def geosurface_save_gas_container( output_filepath, geodata ):
+    """
+    Saves a geosurface in the binary Gas container: the Gas parameters, 
+    together with the calculated surface coordinates, so that it can be reopened without recalculation.
+    
+    The file stores a magic string, the byte length of a JSON header (uint64, little-endian),
+    the JSON header with the Gas parameters, the grid dims, the coordinate type and 
+    the analytical z range, and then the uncompressed coordinate array, aligned 
+    to GAS_CONTAINER_ALIGNMENT bytes so that it can be memory-mapped.
+    
+    @param geodata: Gas parameters dictionary, geosurface and analytical z range.
+    @type geodata: tuple of dict, GridSurface and tuple of two floats.
+    """
+    
+    gas_params, geosurface, z_range = geodata
+    
+    # written to a uniquely named temporary file in the same folder and then renamed, 
+    # since the surface could be memory-mapped from the file being replaced,
+    # and other processes could be saving the same file (e.g., in a GeosurfaceCache)
+    output_dir, output_filename = os.path.split( output_filepath )
+    temp_file, temp_filepath = tempfile.mkstemp( suffix = GAS_CONTAINER_TEMP_SUFFIX, prefix = output_filename + '.', 
+                                                 dir = output_dir or os.curdir )
+    try:
+        with os.fdopen( temp_file, 'wb' ) as outfile:
+            nodes_dtype = write_gas_container_header( outfile, gas_params, geosurface.grid_dims, geosurface.dtype, z_range )
+            for band in export_bands( geosurface ):
+                band.nodes_by_column.astype( nodes_dtype ).tofile( outfile )
+                
+        if os.path.exists( output_filepath ):
+            os.remove( output_filepath )
+        os.rename( temp_filepath, output_filepath )
+    finally:
+        if os.path.exists( temp_filepath ):
+            os.remove( temp_filepath )
+    
+    return True
+
+
+def write_gas_container_header( outfile, gas_params, grid_dims, dtype, z_range ):
+    """
+    Writes the header of a binary Gas container (see geosurface_save_gas_container),
+    that has then to be followed by the node coordinates, column after column.
+    
+    @return: the (little-endian) type of the node coordinates.
+    """
+    
+    nodes_dtype = np.dtype( dtype ).newbyteorder( '<' )
+    
+    header = dict( gas_params )
+    header[ 'grid dims' ] = list( grid_dims )
+    header[ 'dtype' ] = nodes_dtype.str
+    header[ 'analytical z range' ] = [ float( z ) for z in z_range ]
+    header_string = json.dumps( header )
+    
+    header_start = len( GAS_CONTAINER_MAGIC ) + 8
+    data_offset = - ( - ( header_start + len( header_string ) ) // GAS_CONTAINER_ALIGNMENT ) * GAS_CONTAINER_ALIGNMENT
+    header_string = header_string.ljust( data_offset - header_start )
+    
+    outfile.write( GAS_CONTAINER_MAGIC )
+    np.array( [ len( header_string ) ], dtype = '<u8' ).tofile( outfile )
+    outfile.write( header_string )
+    
+    return nodes_dtype
+
+
+def geosurface_read_gas_container( infile_path ):
+    """
+    Opens a binary Gas container (see geosurface_save_gas_container).
+    The coordinates are memory-mapped copy-on-write, 
+    so they are read lazily and they can be modified without changing the file.
     
+    @return: analytical, geographical and deformational parameters, 
+             geosurface (GridSurface) and analytical z range.
+    """
     
-    geosurface_XYZ, _ = geodata
-    X, Y, Z = geosurface_XYZ
-    assert len(X) == len(Y)
-    assert len(X) == len(Z)
+    try:
+        with open( infile_path, 'rb' ) as infile:
+            if infile.read( len( GAS_CONTAINER_MAGIC ) ) != GAS_CONTAINER_MAGIC:
+                raise AnaliticSurfaceIOException, "Input file is not a binary Gas file"
+            header_length = int( np.fromfile( infile, dtype = '<u8', count = 1 )[0] )
+            header = json.loads( infile.read( header_length ) )
+    except AnaliticSurfaceIOException:
+        raise
+    except:
+        raise AnaliticSurfaceIOException, "Check input file name"
+    
+    data_offset = len( GAS_CONTAINER_MAGIC ) + 8 + header_length
+    try:
+        analytical_params = header[ 'analytical surface' ]
+        geographical_params = header[ 'geographical params' ]
+        deformational_params = header.get( 'deformational params', [] )
+        grid_rows, grid_cols = [ int( grid_dim ) for grid_dim in header[ 'grid dims' ] ]
+        nodes_dtype = np.dtype( str( header[ 'dtype' ] ) )
+        z_min, z_max = [ float( z ) for z in header[ 'analytical z range' ] ]
+    except ( KeyError, TypeError, ValueError, AttributeError ):
+        raise AnaliticSurfaceIOException, "Binary Gas file header error"
+    
+    if grid_rows < 1 or grid_cols < 1 or \
+       os.path.getsize( infile_path ) != data_offset + grid_rows * grid_cols * 3 * nodes_dtype.itemsize:
+        raise AnaliticSurfaceIOException, "Binary Gas file size does not match its grid dims (truncated file?)"
+    
+    try:
+        geosurface = GridSurface.memmap( infile_path, 
+                                         ( grid_rows, grid_cols ), 
+                                         nodes_dtype, 
+                                         mode = 'c', 
+                                         offset = data_offset )
+    except ( ValueError, EnvironmentError ):
+        raise AnaliticSurfaceIOException, "Unable to map the binary Gas file"
+    
+    return analytical_params, \
+           geographical_params, \
+           deformational_params, \
+           geosurface, \
+           ( z_min, z_max )
  
-    rec_values_list2 = zip( X, Y, Z )
 
-    with open( xyz_file_path, "w") as ofile:
-        for line in rec_values_list2:
-            ofile.write( ",".join([str(val) for val in line ])+"\n")
+def geosurface_export_xyz( xyz_file_path, geodata, dtype = float, decimals = XYZ_DECIMALS, delimiter = ",", compression = None ):
+    
+    
+    geosurface_XYZ, grid_dims = geodata
+    geosurface = as_grid_surface( geosurface_XYZ, grid_dims, dtype )
+    
+    return geosurface_stream_xyz( xyz_file_path, export_bands( geosurface ), decimals, delimiter, compression )
+
+
+def geosurface_stream_xyz( xyz_file_path, surface_bands, decimals = XYZ_DECIMALS, delimiter = ",", compression = None ):
+    """
+    Saves in the xyz format a surface provided as a sequence of bands of grid columns
+    (see geosurface_stream_vtk).
+    
+    @param decimals: number of decimal digits of the coordinates.
+    @type decimals: int.
+    @param delimiter: the separator of the coordinates in each line.
+    @type delimiter: string.
+    @param compression: whether the output is gzip-compressed 
+                        (default: when the file name ends with '.gz').
+    @type compression: bool.
+    """
+    
+    if compression is None:
+        compression = xyz_file_path.lower().endswith( ".gz" )
+
+    if compression:
+        ofile = gzip.open( xyz_file_path, "wb", XYZ_GZIP_LEVEL )
+    else:
+        ofile = open( xyz_file_path, "w" )
+        
+    with ofile:
+        for band in surface_bands:
+            write_array_rows( ofile, band.xyz, decimals, [ delimiter, delimiter, "\n" ] )
             
     return True 
 
@@ -155,9 +730,19 @@ def geosurface_read_gas_input( infile_path ):
     except:
         raise AnaliticSurfaceIOException, "Check input file name"
    
-        
-    src_analytical_params = input_geosurface['analytical surface']
-    src_geographical_params = input_geosurface['geographical params']
+    return gas_params( input_geosurface )
+
+
+def gas_params( input_geosurface ):
+    """
+    Extracts the analytical, geographical and deformational parameters of a Gas document.
+    """
+    
+    try:
+        src_analytical_params = input_geosurface['analytical surface']
+        src_geographical_params = input_geosurface['geographical params']
+    except ( KeyError, TypeError ):
+        raise AnaliticSurfaceIOException, "Missing Gas parameters"
     try:
         src_deformational_params = input_geosurface['deformational params']
     except:
@@ -166,6 +751,88 @@ def geosurface_read_gas_input( infile_path ):
     return src_analytical_params, src_geographical_params, src_deformational_params
 
 
+def gas_collection_records( infile_path ):
+    """
+    Reads lazily a Gas collection, i.e. a JSON Lines file with a Gas document for each line, 
+    optionally with a 'name' item. Empty lines are skipped.
+    The records are not parsed (see gas_record_params), so that they can be parsed where needed,
+    e.g. in worker processes.
+    
+    @return: generator of ( line number, line text ) tuples.
+    """
+    
+    try:
+        infile = open( infile_path, 'r' )
+    except IOError:
+        raise AnaliticSurfaceIOException, "Check input file name"
+    
+    with infile:
+        for line_number, line in enumerate( infile, 1 ):
+            if line.strip():
+                yield line_number, line
+            
+
+def gas_record_params( record ):
+    """
+    Parses a Gas collection record.
+    
+    @return: name (or None), analytical, geographical and deformational parameters.
+    """
+    
+    try:
+        input_geosurface = json.loads( record )
+    except ValueError:
+        raise AnaliticSurfaceIOException, "Gas record syntax error"
+    
+    if not isinstance( input_geosurface, dict ):
+        raise AnaliticSurfaceIOException, "Gas record is not a JSON object"
+    
+    return ( input_geosurface.get( 'name' ), ) + gas_params( input_geosurface )
+
+
+def geosurface_read_gas_collection( infile_path ):
+    """
+    Reads lazily the surface definitions of a Gas collection, with a single sequential read.
+    
+    @return: generator of ( name, analytical, geographical, deformational parameters ) tuples.
+    """
+    
+    for line_number, record in gas_collection_records( infile_path ):
+        try:
+            yield gas_record_params( record )
+        except AnaliticSurfaceIOException, msg:
+            raise AnaliticSurfaceIOException, "%s (line %d)" % ( msg, line_number )
+
+
+def gas_collection_geosurfaces( infile_path, **geosurface_kwargs ):
+    """
+    Creates lazily the analytical geosurfaces of a Gas collection.
+    
+    @param geosurface_kwargs: further AnalyticGeosurface arguments.
+    
+    @return: generator of ( name, AnalyticGeosurface ) tuples.
+    """
+    
+    for name, analytical_params, geographical_params, deformational_params in geosurface_read_gas_collection( infile_path ):
+        yield name, AnalyticGeosurface( analytical_params, geographical_params, deformational_params, **geosurface_kwargs )
+
+
+def geosurface_save_gas_collection( output_filepath, geodata ):
+    """
+    Saves a Gas collection.
+    
+    @param geodata: the Gas documents (dictionaries with the 'analytical surface', 'geographical params', 
+                    optional 'deformational params' and 'name' items).
+    @type geodata: iterable of dict.
+    """
+    
+    with open( output_filepath, 'w' ) as outfile:
+        for gas_document in geodata:
+            outfile.write( json.dumps( gas_document, separators = ( ',', ':' ) ) + '\n' )
+    
+    return True 
+
+
 
     
     
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+
+from .spatial import AnalyticGeosurface
+from .surf_io import geosurface_save_gas_container, geosurface_read_gas_container, GAS_CONTAINER_MAGIC, \
+                     GAS_CONTAINER_TEMP_SUFFIX
+from .errors import AnaliticSurfaceIOException
+
+
+SURFACE_CACHE_SIZE = 1024 * 1024 * 1024 # bytes
+
+SURFACE_CACHE_SUFFIX = '.gasb'
+
+SURFACE_CACHE_TEMP_AGE = 3600 # seconds after which temporary files are considered left by interrupted writes
+
+
+def normalized_gas_value( value ):
+    """
+    Normalizes a Gas parameter value, so that equivalent parameter sets
+    (e.g., '10' and 10.0, or formulas differing only in the surrounding spaces)
+    have the same representation: numbers become floats and strings are stripped.
+    """
+
+    if isinstance( value, dict ):
+        return dict( ( unicode( key ).strip(), normalized_gas_value( item ) ) for key, item in value.iteritems() )
+    elif isinstance( value, ( list, tuple ) ):
+        return [ normalized_gas_value( item ) for item in value ]
+
+    try:
+        return float( value )
+    except ( TypeError, ValueError ):
+        return unicode( value ).strip()
+
+
+def gas_params_key( analytical_params, geographical_params, deform_params, dtype = float ):
+    """
+    Content hash of the normalized Gas parameters and of the coordinate type.
+
+    @return: hexadecimal string.
+    """
+
+    gas_params = { 'analytical surface': analytical_params,
+                   'geographical params': geographical_params,
+                   'deformational params': list( deform_params ) }
+
+    key_string = json.dumps( [ GAS_CONTAINER_MAGIC,
+                               np.dtype( dtype ).str,
+                               normalized_gas_value( gas_params ) ],
+                             sort_keys = True )
+
+    return hashlib.sha1( key_string ).hexdigest()
+
+
+class GeosurfaceCache( object ):
+    """
+    On-disk cache of calculated geosurfaces, keyed by the hash of their Gas parameters.
+
+    Each surface is stored as a binary Gas container (see surf_io.geosurface_save_gas_container),
+    named by its key. Files are first written with a unique temporary name and then renamed,
+    so that several processes can share the same cache directory; temporary files
+    left by interrupted writes are removed on eviction, once older than SURFACE_CACHE_TEMP_AGE.
+    The least recently used surfaces (by file modification time, updated on each hit)
+    are removed when the cache exceeds its size.
+
+    The state before the last deformation is cached too, so that surfaces
+    differing only in their last deformation are calculated from the cached upstream state.
+    """
+
+    def __init__( self, cache_dir, max_bytes = SURFACE_CACHE_SIZE, cache_prefixes = True ):
+        """
+        @param cache_dir: the cache directory, created when not existing.
+        @type cache_dir: string.
+        @param max_bytes: maximum total size of the cached files.
+        @type max_bytes: int.
+        @param cache_prefixes: whether the state before the last deformation is cached too.
+        @type cache_prefixes: bool.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_prefixes = cache_prefixes
+
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir( cache_dir ):
+            try:
+                os.makedirs( cache_dir )
+            except OSError:
+                if not os.path.isdir( cache_dir ):
+                    raise AnaliticSurfaceIOException, "Unable to create cache directory"
+
+
+    def entry_path( self, key ):
+
+        return os.path.join( self.cache_dir, key + SURFACE_CACHE_SUFFIX )
+
+
+    def geosurface( self, analytical_params, geographical_params, deform_params, dtype = float, **geosurface_kwargs ):
+        """
+        Returns the analytical geosurface for the given Gas parameters,
+        with its georeferenced and deformed surface read from the cache when present,
+        otherwise calculated, from the longest cached deformation prefix, and then cached.
+
+        @param geosurface_kwargs: further AnalyticGeosurface arguments (e.g., workers).
+
+        @return: AnalyticGeosurface.
+        """
+
+        deform_params = list( deform_params )
+
+        anal_geosurface = self.cached_geosurface( analytical_params, geographical_params, deform_params,
+                                                  dtype, **geosurface_kwargs )
+        if anal_geosurface is not None:
+            self.hits += 1
+            return anal_geosurface
+
+        self.misses += 1
+
+        # longest cached deformation prefix
+        for prefix_length in xrange( len( deform_params ) - 1, -1, -1 ):
+            anal_geosurface = self.cached_geosurface( analytical_params, geographical_params, deform_params[ :prefix_length ],
+                                                      dtype, **geosurface_kwargs )
+            if anal_geosurface is not None:
+                break
+        else:
+            prefix_length = max( 0, len( deform_params ) - 1 ) if self.cache_prefixes else len( deform_params )
+            anal_geosurface = AnalyticGeosurface( analytical_params, geographical_params, deform_params[ :prefix_length ],
+                                                  dtype = dtype, **geosurface_kwargs )
+            if prefix_length < len( deform_params ):
+                self.store( anal_geosurface )
+
+        for deform_param in deform_params[ prefix_length: ]:
+            anal_geosurface.add_deformation( deform_param )
+            if self.cache_prefixes and len( anal_geosurface.deformational_params ) == len( deform_params ) - 1:
+                self.store( anal_geosurface )
+
+        self.store( anal_geosurface )
+
+        return anal_geosurface
+
+
+    def cached_geosurface( self, analytical_params, geographical_params, deform_params, dtype = float, **geosurface_kwargs ):
+        """
+        Returns the analytical geosurface with the cached surface, or None when not cached.
+        The surface is memory-mapped copy-on-write, so it can be further deformed
+        without changing the cache.
+
+        @return: AnalyticGeosurface or None.
+        """
+
+        entry_path = self.entry_path( gas_params_key( analytical_params, geographical_params, deform_params, dtype ) )
+
+        try:
+            _, _, _, geosurface, z_range = geosurface_read_gas_container( entry_path )
+            os.utime( entry_path, None )
+        except ( AnaliticSurfaceIOException, OSError, IOError, ValueError ):
+            return None
+
+        return AnalyticGeosurface( analytical_params, geographical_params, deform_params,
+                                   dtype = dtype, geosurface = geosurface, z_range = z_range, **geosurface_kwargs )
+
+
+    def store( self, anal_geosurface ):
+        """
+        Stores the current surface of an analytical geosurface, and then evicts the least recently used surfaces
+        when the cache exceeds its size.
+        """
+
+        key = gas_params_key( anal_geosurface.analytical_params,
+                              anal_geosurface.geographical_params,
+                              anal_geosurface.deformational_params,
+                              anal_geosurface.dtype )
+        entry_path = self.entry_path( key )
+        if os.path.exists( entry_path ):
+            return
+
+        gas_params = { 'analytical surface': anal_geosurface.analytical_params,
+                       'geographical params': anal_geosurface.geographical_params,
+                       'deformational params': anal_geosurface.deformational_params }
+
+        # written through a single temporary file, renamed by the save function
+        try:
+            geosurface_save_gas_container( entry_path,
+                                           ( gas_params, anal_geosurface.geosurface_XYZ(), anal_geosurface.surface_z_range() ) )
+        except OSError: # already stored, and memory-mapped, by another process (Windows)
+            pass
+
+        self.evict()
+
+
+    def entries( self ):
+        """
+        The cached files, from the least to the most recently used.
+
+        @return: list of ( modification time, size, path ) tuples.
+        """
+
+        entries = []
+        for filename in os.listdir( self.cache_dir ):
+            if not filename.endswith( SURFACE_CACHE_SUFFIX ):
+                continue
+            entry_path = os.path.join( self.cache_dir, filename )
+            try:
+                entry_stat = os.stat( entry_path )
+            except OSError: # removed by another process
+                continue
+            entries.append( ( entry_stat.st_mtime, entry_stat.st_size, entry_path ) )
+
+        return sorted( entries )
+
+
+    def cached_bytes( self ):
+
+        return sum( size for _, size, _ in self.entries() )
+
+
+    def evict( self ):
+        """
+        Removes the least recently used surfaces while the cache exceeds its size,
+        and the temporary files left by interrupted writes.
+        """
+
+        self.remove_stale_temp_files()
+
+        entries = self.entries()
+        cached_bytes = sum( size for _, size, _ in entries )
+        for _, size, entry_path in entries:
+            if cached_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove( entry_path )
+            except OSError: # removed by another process, or memory-mapped (Windows)
+                continue
+            cached_bytes -= size
+
+
+    def remove_stale_temp_files( self, max_age = SURFACE_CACHE_TEMP_AGE ):
+        """
+        Removes the temporary files (see surf_io.geosurface_save_gas_container) older than max_age seconds,
+        left by processes interrupted while storing a surface. Newer ones could still be being written.
+        """
+
+        now = time.time()
+        for filename in os.listdir( self.cache_dir ):
+            if not filename.endswith( GAS_CONTAINER_TEMP_SUFFIX ):
+                continue
+            temp_filepath = os.path.join( self.cache_dir, filename )
+            try:
+                if now - os.path.getmtime( temp_filepath ) > max_age:
+                    os.remove( temp_filepath )
+            except OSError: # renamed or removed by another process
+                continue
+
+
+    def clear( self ):
+
+        for _, _, entry_path in self.entries():
+            try:
+                os.remove( entry_path )
+            except OSError:
+                pass
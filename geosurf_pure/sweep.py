@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import os
+
+import numpy as np
+
+from .spatial import AnalyticGeosurface, GridSurface, apply_homogeneous_matrices, compose_transformation, \
+                     deformation_matrices, column_bands, TILE_SIZE
+from .surf_io import write_gas_container_header
+from .errors import AnaliticSurfaceCalcException
+
+
+SWEEP_BATCH_SIZE = 16 # number of variants transformed (and files written) at a time
+
+
+class DeformationSweep( object ):
+    """
+    Parameter sweep over the deformations of a geosurface:
+    the analytical surface is evaluated once, and then each variant,
+    i.e. a chain of deformations, is obtained by applying its total homogeneous matrix
+    (georeferencing and deformations) to the analytical points.
+
+    The variants are transformed in batches, tile by tile, as a stack of (k, 4, 4) matrices,
+    and the results are identical to those of AnalyticGeosurface for each deformation chain.
+    """
+
+    def __init__( self, analytical_params, geogr_params, deform_chains, tile_size = TILE_SIZE, workers = 1, dtype = float ):
+        """
+        @param deform_chains: the deformational parameters of each variant.
+        @type deform_chains: list of lists of dict.
+        @param tile_size: approximate number of transformed nodes in memory at a time,
+                          summed over the variants of a batch.
+        @type tile_size: int.
+        @param workers: number of processes used to evaluate the analytical surface.
+        @type workers: int.
+        @param dtype: float type of the surface node coordinates.
+        @type dtype: numpy float type.
+        """
+
+        self.deform_chains = [ list( deform_params ) for deform_params in deform_chains ]
+        self.tile_size = tile_size
+
+        # analytical surface, evaluated once
+        self.base_geosurface = AnalyticGeosurface( analytical_params, geogr_params, [],
+                                                   tile_size = tile_size, workers = workers, dtype = dtype )
+
+        try:
+            self.transformation_matrices = np.array( [ compose_transformation( self.base_geosurface.geographic_transformation_matrix,
+                                                                               self.base_geosurface.geographic_offset_matrix,
+                                                                               deformation_matrices( deform_params ) )
+                                                       for deform_params in self.deform_chains ] ).reshape( -1, 4, 4 )
+        except ( KeyError, TypeError, ValueError, UnboundLocalError ):
+            raise AnaliticSurfaceCalcException, "Deformation parameter error"
+
+
+    def num_variants( self ):
+
+        return len( self.deform_chains )
+
+
+    def grid_dims( self ):
+
+        return self.base_geosurface.grid_dims()
+
+
+    def gas_params( self, variant_ndx ):
+
+        return { 'analytical surface': self.base_geosurface.analytical_params,
+                 'geographical params': self.base_geosurface.geographical_params,
+                 'deformational params': self.deform_chains[ variant_ndx ] }
+
+
+    def batch_bands( self, variant_ndxs ):
+        """
+        Transforms the analytical surface for a batch of variants, tile by tile.
+
+        @return: generator of ( start column, end column, numpy.array of shape (k, n, 3) ) tuples,
+                 with the nodes of the band for each variant of the batch.
+        """
+
+        grid_rows, grid_cols = self.grid_dims()
+        band_cols = max( 1, self.tile_size // ( grid_rows * max( 1, len( variant_ndxs ) ) ) )
+
+        homog_matrices = self.transformation_matrices[ variant_ndxs ]
+        for start_col, end_col in column_bands( grid_cols, band_cols ):
+            anal_xyz = self.base_geosurface.analytical_surface.column_band( start_col, end_col ).xyz
+            yield start_col, end_col, apply_homogeneous_matrices( anal_xyz, homog_matrices )
+
+
+    def variant_bands( self, variant_ndx ):
+        """
+        The surface of a variant, as bands of grid columns,
+        to be streamed to disk with the surf_io geosurface_stream_* functions.
+
+        @return: generator of GridSurface.
+        """
+
+        grid_rows, _ = self.grid_dims()
+
+        for start_col, end_col, bands_xyz in self.batch_bands( [ variant_ndx ] ):
+            yield GridSurface( bands_xyz[ 0 ].reshape( end_col - start_col, grid_rows, 3 ) )
+
+
+    def variant_geosurface( self, variant_ndx ):
+        """
+        Calculates in memory the surface of a variant.
+
+        @return: GridSurface.
+        """
+
+        geosurface = GridSurface.empty( self.grid_dims(), self.base_geosurface.dtype )
+        for start_col, end_col, bands_xyz in self.batch_bands( [ variant_ndx ] ):
+            geosurface.column_band( start_col, end_col ).xyz[:] = bands_xyz[ 0 ]
+
+        return geosurface
+
+
+    def save_gas_containers( self, output_filepaths, batch_size = SWEEP_BATCH_SIZE ):
+        """
+        Saves each variant in a binary Gas container (see surf_io.geosurface_save_gas_container),
+        streaming the transformed tiles of a batch of variants to their files.
+
+        @param output_filepaths: the file path of each variant.
+        @type output_filepaths: list of strings.
+
+        @return: True.
+        """
+
+        assert len( output_filepaths ) == self.num_variants()
+
+        z_range = self.base_geosurface.surface_z_range()
+
+        for start_ndx in xrange( 0, self.num_variants(), batch_size ):
+            variant_ndxs = range( start_ndx, min( start_ndx + batch_size, self.num_variants() ) )
+            temp_filepaths = [ output_filepaths[ variant_ndx ] + '.tmp' for variant_ndx in variant_ndxs ]
+            outfiles = [ open( temp_filepath, 'wb' ) for temp_filepath in temp_filepaths ]
+            try:
+                nodes_dtypes = [ write_gas_container_header( outfile,
+                                                             self.gas_params( variant_ndx ),
+                                                             self.grid_dims(),
+                                                             self.base_geosurface.dtype,
+                                                             z_range )
+                                 for outfile, variant_ndx in zip( outfiles, variant_ndxs ) ]
+                for _, _, bands_xyz in self.batch_bands( variant_ndxs ):
+                    for outfile, nodes_dtype, band_xyz in zip( outfiles, nodes_dtypes, bands_xyz ):
+                        band_xyz.astype( nodes_dtype, copy = False ).tofile( outfile )
+            finally:
+                for outfile in outfiles:
+                    outfile.close()
+
+            for temp_filepath, variant_ndx in zip( temp_filepaths, variant_ndxs ):
+                if os.path.exists( output_filepaths[ variant_ndx ] ):
+                    os.remove( output_filepaths[ variant_ndx ] )
+                os.rename( temp_filepath, output_filepaths[ variant_ndx ] )
+
+        return True
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+TOPOLOGY_CACHE_SIZE = 16
+TOPOLOGY_CACHE_BYTES = 64 * 1024 * 1024 # larger topologies are not cached
+
+_topologies = OrderedDict()
+
+
+def cached_topology( topology_func ):
+    """
+    Decorator caching the index arrays of a grid topology, keyed by the grid shape.
+    Cached arrays are read-only, since they are shared by all the users.
+    The cache keeps at most TOPOLOGY_CACHE_SIZE arrays and TOPOLOGY_CACHE_BYTES bytes,
+    evicting the least recently used ones; arrays larger than the byte budget are not cached.
+    """
+
+    def cached_topology_func( grid_dims ):
+
+        topology_key = ( topology_func.__name__, tuple( grid_dims ) )
+        try:
+            topology = _topologies.pop( topology_key )
+        except KeyError:
+            topology = topology_func( tuple( grid_dims ) )
+            topology.setflags( write = False )
+            if topology.nbytes > TOPOLOGY_CACHE_BYTES:
+                return topology
+
+        _topologies[ topology_key ] = topology
+        cached_bytes = sum( cached_topology.nbytes for cached_topology in _topologies.itervalues() )
+        while len( _topologies ) > TOPOLOGY_CACHE_SIZE or cached_bytes > TOPOLOGY_CACHE_BYTES:
+            _, evicted_topology = _topologies.popitem( last = False )
+            cached_bytes -= evicted_topology.nbytes
+
+        return topology
+
+    cached_topology_func.__name__ = topology_func.__name__
+    cached_topology_func.__doc__ = topology_func.__doc__
+
+    return cached_topology_func
+
+
+def grid_triangles( grid_dims ):
+    """
+    Triangles of a (rows, cols) grid, whose nodes are indexed column after column:
+    two triangles for each grid cell, in the column then row order of the cells.
+    Cached (see band_triangles).
+
+    @return: numpy.array of node indices, shape (2*(rows-1)*(cols-1), 3).
+    """
+
+    n_rows, n_cols = grid_dims
+
+    return band_triangles( ( n_rows, n_cols - 1 ) )
+
+
+@cached_topology
+def band_triangles( band_dims ):
+    """
+    Triangles of a band of (rows, cell columns) grid cells, with node indices
+    relative to the first node of the band. The pattern is the same for all the bands
+    of equal width, whose triangles differ only by the index of their first node.
+
+    @return: numpy.array of node indices, shape (2*(rows-1)*cell columns, 3).
+    """
+
+    n_rows, band_cols = band_dims
+
+    start_ndxs = ( np.arange( band_cols )[ :, np.newaxis ] * n_rows + np.arange( n_rows - 1 ) ).ravel()
+    forward_ndxs = start_ndxs + n_rows
+
+    triangles = np.empty( ( len( start_ndxs ), 2, 3 ), dtype = np.int64 )
+    triangles[ :, 0 ] = np.column_stack( ( start_ndxs, start_ndxs + 1, forward_ndxs ) )
+    triangles[ :, 1 ] = np.column_stack( ( forward_ndxs, start_ndxs + 1, forward_ndxs + 1 ) )
+
+    return triangles.reshape( -1, 3 )
+
+
+@cached_topology
+def band_triangle_strips( band_dims ):
+    """
+    Triangle strips of a band of (rows, cell columns) grid cells, with node indices
+    relative to the first node of the band: one strip for each cell column,
+    alternating the node indices of the following and of the current column.
+
+    @return: numpy.array of node indices, shape (cell columns, 2*rows).
+    """
+
+    n_rows, band_cols = band_dims
+
+    column_start_ndxs = np.arange( band_cols )[ :, np.newaxis ] * n_rows
+    row_ndxs = np.arange( n_rows )
+
+    strips = np.empty( ( band_cols, 2 * n_rows ), dtype = np.int64 )
+    strips[ :, 0::2 ] = column_start_ndxs + n_rows + row_ndxs
+    strips[ :, 1::2 ] = column_start_ndxs + row_ndxs
+
+    return strips
+
+
+def column_triangles( grid_dims, start_col, end_col ):
+    """
+    Triangles of the grid cells between the columns start_col and end_col (included),
+    i.e. of the cell columns from start_col to end_col (excluded),
+    from the cached pattern of the band (see band_triangles).
+
+    @return: numpy.array of node indices, shape (2*(rows-1)*(end_col-start_col), 3).
+    """
+
+    n_rows, _ = grid_dims
+
+    return band_triangles( ( n_rows, end_col - start_col ) ) + start_col * n_rows
+
+
+def column_triangle_strips( grid_dims, start_col, end_col ):
+    """
+    Triangle strips of the cell columns from start_col to end_col (excluded),
+    from the cached pattern of the band (see band_triangle_strips).
+
+    @return: numpy.array of node indices, shape (end_col-start_col, 2*rows).
+    """
+
+    n_rows, _ = grid_dims
+
+    return band_triangle_strips( ( n_rows, end_col - start_col ) ) + start_col * n_rows
+
+
+def grid_decimation_step( grid_dims, max_faces ):
+    """
+    Smallest subsampling step of the grid rows and columns (see GridSurface.subsampled)
+    such that the grid triangles are at most max_faces (or a single grid cell remains).
+    """
+    
+    n_rows, n_cols = grid_dims
+    
+    def num_faces( step ):
+        return 2 * ( - ( - ( n_rows - 1 ) // step ) ) * ( - ( - ( n_cols - 1 ) // step ) )
+    
+    step = max( 1, int( np.sqrt( num_faces( 1 ) / max( 1, max_faces ) ) ) )
+    while num_faces( step ) > max_faces and step < max( n_rows, n_cols ):
+        step += 1
+    
+    return step
+
+
+def clear_topology_cache():
+
+    _topologies.clear()
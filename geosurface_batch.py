@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ simSurf
+
+ Simulation and deformation of georeferenced geological surfaces
+                              -------------------
+        version              : 0.0.2
+        copyright            : (C) 2014-2016 by Mauro Alberti - www.malg.eu
+        email                : alberti.m65@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 3 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Headless batch processing of Gas files and Gas collections (.jsonl): each surface
+is calculated and saved in the requested formats, in a pool of worker processes.
+It does not import Qt or matplotlib, so that it can run on servers without display.
+
+Example:
+
+    python geosurface_batch.py surfaces_dir manifest.txt sweep.jsonl -o out_dir -f vtp xyz.gz -j 8
+"""
+
+
+from __future__  import division
+
+import os, sys
+import time
+import json
+import argparse
+import itertools
+
+from collections import OrderedDict
+
+import numpy as np
+
+from geosurf_pure.spatial import AnalyticGeosurface
+from geosurf_pure.surf_io import geosurface_export_vtk, geosurface_export_grass, geosurface_save_gas, \
+                           geosurface_read_gas_input, geosurface_export_esri_generate, geosurface_export_xyz, \
+                           geosurface_export_vtk_binary, geosurface_export_vtp, geosurface_export_ply, geosurface_export_stl, \
+                           geosurface_save_gas_container, gas_collection_records, gas_record_params
+from geosurf_pure.surface_cache import GeosurfaceCache, SURFACE_CACHE_SIZE
+
+
+__version__ = "0.0.2"
+
+
+# output format: ( file name suffix, export function )
+BATCH_FORMATS = OrderedDict( [ ( 'vtk', ( '.vtk', geosurface_export_vtk ) ),
+                               ( 'vtk-binary', ( '.binary.vtk', geosurface_export_vtk_binary ) ),
+                               ( 'vtp', ( '.vtp', geosurface_export_vtp ) ),
+                               ( 'ply', ( '.ply', geosurface_export_ply ) ),
+                               ( 'stl', ( '.stl', geosurface_export_stl ) ),
+                               ( 'grass', ( '.txt', geosurface_export_grass ) ),
+                               ( 'xyz', ( '.xyz', geosurface_export_xyz ) ),
+                               ( 'xyz.gz', ( '.xyz.gz', geosurface_export_xyz ) ),
+                               ( 'generate', ( '.gen', geosurface_export_esri_generate ) ),
+                               ( 'gas', ( '.gas.json', geosurface_save_gas ) ),
+                               ( 'gasb', ( '.gasb', geosurface_save_gas_container ) ) ] )
+
+BATCH_TASKS_PER_CHILD = 16 # worker processes are replaced after these surfaces, releasing their memory
+
+
+GAS_FILE_EXTENSIONS = ( '.json', '.jsonl' )
+
+
+def gas_filepaths( input_paths ):
+    """
+    Lists the Gas files and Gas collections to process, from Gas files and collections,
+    directories (all their .json and .jsonl files) and manifests (text files with a file path for each line, 
+    relative to the manifest folder; empty lines and lines starting with '#' are skipped).
+    Not existing or unreadable manifests are listed as they are, so that they are reported as failed Gas files.
+    """
+
+    for input_path in input_paths:
+        if os.path.isdir( input_path ):
+            for filename in sorted( os.listdir( input_path ) ):
+                if os.path.splitext( filename )[1].lower() in GAS_FILE_EXTENSIONS:
+                    yield os.path.join( input_path, filename )
+        elif os.path.splitext( input_path )[1].lower() in GAS_FILE_EXTENSIONS:
+            yield input_path
+        else:
+            try:
+                manifest = open( input_path, 'r' )
+            except IOError:
+                yield input_path
+                continue
+            manifest_dir = os.path.dirname( input_path )
+            with manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith( '#' ):
+                        yield os.path.join( manifest_dir, line )
+
+
+def gas_sources( gas_filepaths ):
+    """
+    Lists the surfaces to process: one for each Gas file, and one for each record of the Gas collections.
+    Collections are read sequentially, reading only the record names: 
+    the records are parsed by the worker processes.
+    Output names are the Gas file names or the record names (by default, the collection name and line number),
+    made unique (see unique_output_name), so that two sources are never saved to the same files.
+
+    @return: generator of ( source label, output name, collection record or None ) tuples.
+    """
+
+    used_names = set()
+    for gas_filepath in gas_filepaths:
+        output_name = os.path.splitext( os.path.basename( gas_filepath ) )[0]
+        # not existing collections are reported as failed Gas files
+        if gas_filepath.lower().endswith( '.jsonl' ) and os.path.isfile( gas_filepath ):
+            for line_number, record in gas_collection_records( gas_filepath ):
+                record_name = gas_record_name( record ) or "%s_%06d" % ( output_name, line_number )
+                yield "%s:%d" % ( gas_filepath, line_number ), unique_output_name( record_name, used_names ), record
+        else:
+            yield gas_filepath, unique_output_name( output_name, used_names ), None
+
+
+def gas_record_name( record ):
+    """
+    The name of a Gas collection record, usable as a file name.
+    
+    @return: string, or None when the record has no name or cannot be parsed 
+             (its errors are reported by the worker processes).
+    """
+    
+    try:
+        record_name = json.loads( record ).get( 'name' )
+    except ( ValueError, AttributeError ):
+        return None
+
+    if not record_name:
+        return None
+
+    return os.path.basename( unicode( record_name ) ) or None
+
+
+def unique_output_name( output_name, used_names ):
+    """
+    Makes an output name unique, appending a counter to the names already used
+    (compared ignoring case, for case-insensitive file systems).
+    
+    @param used_names: the lower case names already used, updated with the returned name.
+    @type used_names: set.
+    """
+    
+    unique_name, counter = output_name, 1
+    while unique_name.lower() in used_names:
+        counter += 1
+        unique_name = "%s_%d" % ( output_name, counter )
+    used_names.add( unique_name.lower() )
+    
+    return unique_name
+
+
+def output_filepath( output_name, output_dir, format_name ):
+
+    suffix, _ = BATCH_FORMATS[ format_name ]
+
+    return os.path.join( output_dir, output_name + suffix )
+
+
+def export_geosurface( anal_geosurface, format_name, output_path ):
+    """
+    Saves the calculated geosurface in one of the BATCH_FORMATS.
+    """
+
+    _, save_function = BATCH_FORMATS[ format_name ]
+
+    gas_params = {'analytical surface': anal_geosurface.analytical_params,
+                  'geographical params': anal_geosurface.geographical_params,
+                  'deformational params': anal_geosurface.deformational_params }
+    geosurface = anal_geosurface.geosurface_XYZ()
+
+    if format_name == 'gas':
+        geodata = gas_params
+    elif format_name == 'gasb':
+        geodata = gas_params, geosurface, anal_geosurface.surface_z_range()
+    else:
+        geodata = geosurface, geosurface.grid_dims
+
+    return save_function( output_path, geodata )
+
+
+def process_gas_source( task ):
+    """
+    Calculates the surface of a Gas file or collection record and saves it in the requested formats.
+    Run in the worker processes: errors are returned, not raised.
+
+    @param task: source (see gas_sources), output folder, format names, coordinate type,
+                 cache folder (or None) and cache size.
+    @type task: tuple.
+
+    @return: source label, OrderedDict of the step timings (seconds), error message (or None).
+    """
+
+    ( source_label, output_name, record ), output_dir, format_names, dtype, cache_dir, cache_size = task
+
+    timings = OrderedDict()
+    try:
+        start_time = time.time()
+        if record is None:
+            analytical_params, geographical_params, deformational_params = geosurface_read_gas_input( source_label )
+        else:
+            _, analytical_params, geographical_params, deformational_params = gas_record_params( record )
+        timings[ 'read' ] = time.time() - start_time
+
+        start_time = time.time()
+        if cache_dir is None:
+            anal_geosurface = AnalyticGeosurface( analytical_params, geographical_params, deformational_params,
+                                                  dtype = dtype )
+        else:
+            anal_geosurface = GeosurfaceCache( cache_dir, cache_size ).geosurface( analytical_params,
+                                                                                   geographical_params,
+                                                                                   deformational_params,
+                                                                                   dtype )
+        anal_geosurface.geosurface_XYZ()
+        timings[ 'calculation' ] = time.time() - start_time
+
+        for format_name in format_names:
+            start_time = time.time()
+            if not export_geosurface( anal_geosurface, format_name, output_filepath( output_name, output_dir, format_name ) ):
+                raise IOError, "Unable to save as %s" % format_name
+            timings[ format_name ] = time.time() - start_time
+    except Exception, msg:
+        return source_label, timings, "%s: %s" % ( type( msg ).__name__, msg )
+
+    return source_label, timings, None
+
+
+def format_report( source_label, timings, error ):
+
+    timings_txt = ", ".join( "%s %.2f s" % ( step, seconds ) for step, seconds in timings.iteritems() )
+    if error is None:
+        return "ok      %s (%s; total %.2f s)" % ( source_label, timings_txt, sum( timings.values() ) )
+    else:
+        return "FAILED  %s (%s): %s" % ( source_label, timings_txt, error )
+
+
+def run_batch( tasks, jobs ):
+    """
+    Processes the surfaces in a pool of jobs worker processes (in this process when jobs is 1),
+    yielding the results as they are completed.
+    """
+
+    if jobs == 1:
+        for result in itertools.imap( process_gas_source, tasks ):
+            yield result
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool( jobs, maxtasksperchild = BATCH_TASKS_PER_CHILD )
+    try:
+        for result in pool.imap_unordered( process_gas_source, tasks ):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parse_args( args ):
+
+    parser = argparse.ArgumentParser( description = "Calculates the surfaces of Gas files and saves them in the requested formats." )
+    parser.add_argument( 'inputs', nargs = '+',
+                         help = "Gas files, Gas collections (.jsonl), folders of them or manifests listing them" )
+    parser.add_argument( '-o', '--output-dir', required = True,
+                         help = "output folder" )
+    parser.add_argument( '-f', '--formats', nargs = '+', choices = BATCH_FORMATS.keys(), default = [ 'vtk' ],
+                         help = "output formats (default: vtk)" )
+    parser.add_argument( '-j', '--jobs', type = int, default = None,
+                         help = "number of worker processes (default: the available cores)" )
+    parser.add_argument( '--float32', action = 'store_true',
+                         help = "calculate the coordinates in single precision" )
+    parser.add_argument( '--cache-dir', default = None,
+                         help = "folder of the on-disk cache of the calculated surfaces" )
+    parser.add_argument( '--cache-size', type = int, default = SURFACE_CACHE_SIZE // ( 1024 * 1024 ),
+                         help = "maximum size of the cache, in MB" )
+
+    return parser.parse_args( args )
+
+
+def main( args = None ):
+    """
+    Main of the module.
+
+    @return: the exit status: 0 when all the surfaces were processed, 1 otherwise.
+    """
+
+    options = parse_args( args )
+
+    if options.jobs is None:
+        import multiprocessing
+        options.jobs = multiprocessing.cpu_count()
+
+    if not os.path.isdir( options.output_dir ):
+        os.makedirs( options.output_dir )
+
+    dtype = np.float32 if options.float32 else float
+    tasks = ( ( gas_source, options.output_dir, options.formats, dtype, options.cache_dir, options.cache_size * 1024 * 1024 )
+              for gas_source in gas_sources( gas_filepaths( options.inputs ) ) )
+
+    start_time = time.time()
+    processed = failures = 0
+    for source_label, timings, error in run_batch( tasks, max( 1, options.jobs ) ):
+        processed += 1
+        if error is not None:
+            failures += 1
+        print format_report( source_label, timings, error )
+        sys.stdout.flush()
+
+    print "%d surfaces processed, %d failed, in %.2f s" % ( processed, failures, time.time() - start_time )
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -33,11 +33,10 @@ from PyQt4.QtGui import *
  
 from geosurf_pure.spatial import AnalyticGeosurface
 from geosurf_pure.surf_io import geosurface_export_vtk, geosurface_export_grass, geosurface_save_gas, \
-                           geosurface_read_gas_input, geosurface_export_esri_generate, geosurface_export_xyz
+                           geosurface_read_gas_input, geosurface_save_gas_container, geosurface_read_gas_container, geosurface_export_esri_generate, geosurface_export_xyz, \
+                           geosurface_export_vtk_binary, geosurface_export_vtp, geosurface_export_ply, geosurface_export_stl
 from geosurf_pure.errors import AnaliticSurfaceIOException, AnaliticSurfaceCalcException
  
-from mpl.mpl_widget import view_3D_surface
- 
  
 __version__ = "0.0.2"
 
@@ -145,6 +144,16 @@ class GeosurfaceDeformationDialog( QDialog ):
         vert_shear_QPushButton.clicked[bool].connect( self.do_vert_shear ) 
         vert_shear_QPushButton.setEnabled( True )       
         deformationLayout.addWidget( vert_shear_QPushButton, 4, 0, 1, 1 )
+
+        undo_QPushButton = QPushButton( "Undo last deformation" )
+        undo_QPushButton.clicked[bool].connect( self.undo_deformation ) 
+        undo_QPushButton.setEnabled( True )       
+        deformationLayout.addWidget( undo_QPushButton, 5, 0, 1, 1 )
+
+        redo_QPushButton = QPushButton( "Redo deformation" )
+        redo_QPushButton.clicked[bool].connect( self.redo_deformation ) 
+        redo_QPushButton.setEnabled( True )       
+        deformationLayout.addWidget( redo_QPushButton, 6, 0, 1, 1 )
                                                             
         deformationWidget.setLayout( deformationLayout )
         
@@ -189,18 +198,33 @@ class GeosurfaceDeformationDialog( QDialog ):
        
         self.save_as_esri_generate_QRadioButton = QRadioButton( "3D ESRI generate")
         outputLayout.addWidget( self.save_as_esri_generate_QRadioButton, 1, 3, 1, 2 )
+
+        self.save_as_vtk_binary_QRadioButton = QRadioButton( "VTK binary")
+        outputLayout.addWidget( self.save_as_vtk_binary_QRadioButton, 2, 1, 1, 2 )
+
+        self.save_as_vtp_QRadioButton = QRadioButton( "VTK XML (vtp, zlib)")
+        outputLayout.addWidget( self.save_as_vtp_QRadioButton, 2, 3, 1, 2 )
+
+        self.save_as_ply_QRadioButton = QRadioButton( "PLY (binary)")
+        outputLayout.addWidget( self.save_as_ply_QRadioButton, 3, 1, 1, 2 )
+
+        self.save_as_stl_QRadioButton = QRadioButton( "STL (binary)")
+        outputLayout.addWidget( self.save_as_stl_QRadioButton, 3, 3, 1, 2 )
+
+        self.save_as_gas_container_QRadioButton = QRadioButton( "Gas binary (with surface)")
+        outputLayout.addWidget( self.save_as_gas_container_QRadioButton, 4, 1, 1, 2 )
                                
         simulation_output_browse_QPushButton = QPushButton("Save as ...")
         simulation_output_browse_QPushButton.clicked.connect( self.select_output_file )
-        outputLayout.addWidget( simulation_output_browse_QPushButton, 2, 0, 1, 1 )
+        outputLayout.addWidget( simulation_output_browse_QPushButton, 5, 0, 1, 1 )
 
         self.simulation_outputfilename_QLineEdit = QLineEdit()
-        outputLayout.addWidget( self.simulation_outputfilename_QLineEdit, 2, 1, 1, 4 )
+        outputLayout.addWidget( self.simulation_outputfilename_QLineEdit, 5, 1, 1, 4 )
             
         self.save_surface_pButton = QPushButton( "Save surface" )
         self.save_surface_pButton.clicked[bool].connect( self.save_surface ) 
         self.save_surface_pButton.setEnabled( True )       
-        outputLayout.addWidget( self.save_surface_pButton, 3, 0, 1, 5 )        
+        outputLayout.addWidget( self.save_surface_pButton, 6, 0, 1, 5 )        
         
         outputWidget.setLayout( outputLayout )
         
@@ -244,7 +268,7 @@ class GeosurfaceDeformationDialog( QDialog ):
     def select_input_file( self ):
             
         short_txt = "*.json"
-        long_txt = "Gas (*.json *.JSON)"
+        long_txt = "Gas (*.json *.JSON);;Gas binary (*.gasb *.GASB)"
                                  
         input_filename = QFileDialog.getOpenFileName(self, 
                                                       self.tr( "Open file: " ), 
@@ -264,9 +288,17 @@ class GeosurfaceDeformationDialog( QDialog ):
 
     def load_input_geosurface(self):
 
+        input_filename = unicode( self.input_filename_QLineEdit.text() )
         try:
-            self.analytical_params, self.geographical_params, self.deformational_params = geosurface_read_gas_input( self.input_filename_QLineEdit.text() )
-            self.create_geosurface()                  
+            if os.path.splitext( input_filename )[1].lower() == '.gasb':
+                self.analytical_params, self.geographical_params, self.deformational_params, geosurface, z_range = \
+                    geosurface_read_gas_container( input_filename )
+                self.anal_geosurface = AnalyticGeosurface( self.analytical_params, self.geographical_params, self.deformational_params,
+                                                           dtype = geosurface.dtype, geosurface = geosurface, z_range = z_range )
+                self.geosurface_xyz_values = self.anal_geosurface.geosurface_XYZ()
+            else:
+                self.analytical_params, self.geographical_params, self.deformational_params = geosurface_read_gas_input( input_filename )
+                self.create_geosurface()                  
         except ( AnaliticSurfaceIOException, AnaliticSurfaceCalcException ), msg:
             QMessageBox.critical( self, "Surface import", str(msg) )
             return  
@@ -340,13 +372,13 @@ class GeosurfaceDeformationDialog( QDialog ):
             QMessageBox.critical( self, "Displacement", "Error in input values" )
             return             
                 
-        self.deformational_params.append( {'type':'displacement', 
-                                           'parameters': {'delta_x' : delta_x, 
-                                                          'delta_y' : delta_y, 
-                                                          'delta_z' : delta_z } } )
+        deformational_param = {'type':'displacement', 
+                               'parameters': {'delta_x' : delta_x, 
+                                              'delta_y' : delta_y, 
+                                              'delta_z' : delta_z } }
 
         try:
-            self.create_geosurface()
+            self.geosurface_xyz_values = self.anal_geosurface.add_deformation( deformational_param )
         except AnaliticSurfaceCalcException, msg:
             QMessageBox.critical( self, "Surface displacement", str(msg) )
         else:
@@ -368,16 +400,16 @@ class GeosurfaceDeformationDialog( QDialog ):
             QMessageBox.critical( self, "Rotation", "Error in input values" )
             return          
         
-        self.deformational_params.append( {'type':'rotation', 
-                                       'parameters': {'rotation axis trend' : rot_axis_trend, 
-                                                      'rotation axis plunge' : rot_axis_plunge, 
-                                                      'rotation angle' : rot_angle_degr,
-                                                      'center x': center_x,
-                                                      'center y': center_y,
-                                                      'center z': center_z, } } )
+        deformational_param = {'type':'rotation', 
+                               'parameters': {'rotation axis trend' : rot_axis_trend, 
+                                              'rotation axis plunge' : rot_axis_plunge, 
+                                              'rotation angle' : rot_angle_degr,
+                                              'center x': center_x,
+                                              'center y': center_y,
+                                              'center z': center_z, } }
 
         try:
-            self.create_geosurface()
+            self.geosurface_xyz_values = self.anal_geosurface.add_deformation( deformational_param )
         except AnaliticSurfaceCalcException, msg:
             QMessageBox.critical( self, "Surface rotation", str(msg) )
         else:
@@ -403,16 +435,16 @@ class GeosurfaceDeformationDialog( QDialog ):
             QMessageBox.critical( self, "Scaling", "Input value(s) cannot be zero" )
             return
                 
-        self.deformational_params.append( {'type':'scaling', 
-                                           'parameters': {'x factor' : scale_factor_x, 
-                                                          'y factor' : scale_factor_y, 
-                                                          'z factor' : scale_factor_z,
-                                                          'center x': center_x,
-                                                          'center y': center_y,
-                                                          'center z': center_z, } } )
+        deformational_param = {'type':'scaling', 
+                               'parameters': {'x factor' : scale_factor_x, 
+                                              'y factor' : scale_factor_y, 
+                                              'z factor' : scale_factor_z,
+                                              'center x': center_x,
+                                              'center y': center_y,
+                                              'center z': center_z, } }
 
         try:
-            self.create_geosurface()
+            self.geosurface_xyz_values = self.anal_geosurface.add_deformation( deformational_param )
         except AnaliticSurfaceCalcException, msg:
             QMessageBox.critical( self, "Surface scaling", str(msg) )
         else:
@@ -433,15 +465,15 @@ class GeosurfaceDeformationDialog( QDialog ):
             QMessageBox.critical( self, "Simple shear (horizontal)", "Error in input values" )
             return          
         
-        self.deformational_params.append( {'type':'simple shear - horizontal', 
-                                           'parameters': {'psi angle (degr.)' : psi_angle_degr, 
-                                                          'alpha angle (degr.)' : alpha_angle_degr,
-                                                          'center x': center_x,
-                                                          'center y': center_y,
-                                                          'center z': center_z, } } )
+        deformational_param = {'type':'simple shear - horizontal', 
+                               'parameters': {'psi angle (degr.)' : psi_angle_degr, 
+                                              'alpha angle (degr.)' : alpha_angle_degr,
+                                              'center x': center_x,
+                                              'center y': center_y,
+                                              'center z': center_z, } }
 
         try:
-            self.create_geosurface()
+            self.geosurface_xyz_values = self.anal_geosurface.add_deformation( deformational_param )
         except AnaliticSurfaceCalcException, msg:
             QMessageBox.critical( self, "Surface simple shear (horiz.)", str(msg) )
         else:
@@ -462,20 +494,44 @@ class GeosurfaceDeformationDialog( QDialog ):
             QMessageBox.critical( self, "Simple shear (vertical)", "Error in input values" )
             return          
         
-        self.deformational_params.append( {'type':'simple shear - vertical', 
-                                           'parameters': {'psi angle (degr.)' : psi_angle_degr, 
-                                                          'alpha angle (degr.)' : alpha_angle_degr,
-                                                          'center x': center_x,
-                                                          'center y': center_y,
-                                                          'center z': center_z, } } )
+        deformational_param = {'type':'simple shear - vertical', 
+                               'parameters': {'psi angle (degr.)' : psi_angle_degr, 
+                                              'alpha angle (degr.)' : alpha_angle_degr,
+                                              'center x': center_x,
+                                              'center y': center_y,
+                                              'center z': center_z, } }
         try:
-            self.create_geosurface()
+            self.geosurface_xyz_values = self.anal_geosurface.add_deformation( deformational_param )
         except AnaliticSurfaceCalcException, msg:
             QMessageBox.critical( self, "Surface simple shear (vert.)", str(msg) )
         else:
             QMessageBox.information( self, "Surface simple shear (vert.)", "Done" ) 
 
     
+    def undo_deformation( self ):
+        
+        if not self.test_input_geosurface("Undo deformation"):  return
+        
+        try:
+            self.geosurface_xyz_values = self.anal_geosurface.undo_deformation()
+        except AnaliticSurfaceCalcException, msg:
+            QMessageBox.critical( self, "Undo deformation", str(msg) )
+        else:
+            QMessageBox.information( self, "Undo deformation", "Done" ) 
+
+
+    def redo_deformation( self ):
+        
+        if not self.test_input_geosurface("Redo deformation"):  return
+        
+        try:
+            self.geosurface_xyz_values = self.anal_geosurface.redo_deformation()
+        except AnaliticSurfaceCalcException, msg:
+            QMessageBox.critical( self, "Redo deformation", str(msg) )
+        else:
+            QMessageBox.information( self, "Redo deformation", "Done" ) 
+
+    
     def view_geosurface( self ):
  
         try:        
@@ -485,6 +541,7 @@ class GeosurfaceDeformationDialog( QDialog ):
 
         if geosurface_xyz_values:
             try:          
+                from mpl.mpl_widget import view_3D_surface # matplotlib is loaded only when plotting
                 view_3D_surface( geosurface_xyz_values )
             except:
                 QMessageBox.critical( self, "Surface view", "Unable to create plot. Try exporting as VTK/Grass and using Paraview or Grass for visualization" )                
@@ -494,18 +551,30 @@ class GeosurfaceDeformationDialog( QDialog ):
                 
     def select_output_file( self ):
             
-        if self.save_as_vtk_QRadioButton.isChecked():
+        if self.save_as_vtk_QRadioButton.isChecked() or self.save_as_vtk_binary_QRadioButton.isChecked():
             short_txt = "*.vtk"
             long_txt = "vtk (*.vtk *.VTK)"
+        elif self.save_as_vtp_QRadioButton.isChecked():
+            short_txt = "*.vtp"
+            long_txt = "vtp (*.vtp *.VTP)"
+        elif self.save_as_ply_QRadioButton.isChecked():
+            short_txt = "*.ply"
+            long_txt = "ply (*.ply *.PLY)"
+        elif self.save_as_stl_QRadioButton.isChecked():
+            short_txt = "*.stl"
+            long_txt = "stl (*.stl *.STL)"
         elif self.save_as_grass_QRadioButton.isChecked():
             short_txt = "*.txt"
             long_txt = "txt (*.txt *.TXT)"
         elif self.save_as_gas_QRadioButton.isChecked():
             short_txt = "*.json"
             long_txt = "json (*.json *.JSON)" 
+        elif self.save_as_gas_container_QRadioButton.isChecked():
+            short_txt = "*.gasb"
+            long_txt = "gas binary (*.gasb *.GASB)" 
         elif self.save_as_xyz_QRadioButton.isChecked():
             short_txt = "*.xyz"
-            long_txt = "xyz (*.xyz *.XYZ)"               
+            long_txt = "xyz (*.xyz *.XYZ);;gzipped xyz (*.xyz.gz *.XYZ.GZ)"               
         elif self.save_as_esri_generate_QRadioButton.isChecked():
             short_txt = "*.*"
             long_txt = "generate file (*.*)"  
@@ -530,6 +599,14 @@ class GeosurfaceDeformationDialog( QDialog ):
         geodata = self.geosurface_xyz_values, self.anal_geosurface.anal_param_values[1]
         if self.save_as_vtk_QRadioButton.isChecked():
             save_function = geosurface_export_vtk
+        elif self.save_as_vtk_binary_QRadioButton.isChecked():
+            save_function = geosurface_export_vtk_binary
+        elif self.save_as_vtp_QRadioButton.isChecked():
+            save_function = geosurface_export_vtp
+        elif self.save_as_ply_QRadioButton.isChecked():
+            save_function = geosurface_export_ply
+        elif self.save_as_stl_QRadioButton.isChecked():
+            save_function = geosurface_export_stl
         elif self.save_as_grass_QRadioButton.isChecked():
             save_function = geosurface_export_grass 
         elif self.save_as_xyz_QRadioButton.isChecked():
@@ -539,6 +616,13 @@ class GeosurfaceDeformationDialog( QDialog ):
             geodata = {'analytical surface': self.analytical_params,
                        'geographical params': self.geographical_params,
                        'deformational params': self.anal_geosurface.deformational_params }
+        elif self.save_as_gas_container_QRadioButton.isChecked():
+            save_function = geosurface_save_gas_container
+            geodata = {'analytical surface': self.analytical_params,
+                       'geographical params': self.geographical_params,
+                       'deformational params': self.anal_geosurface.deformational_params }, \
+                      self.geosurface_xyz_values, \
+                      self.anal_geosurface.surface_z_range()
         elif self.save_as_esri_generate_QRadioButton.isChecked():
             save_function = geosurface_export_esri_generate
                  
@@ -952,7 +1036,8 @@ def main():
 
 
 
-main()       
+if __name__ == "__main__":
+    main()
 
 
 
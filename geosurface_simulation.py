@@ -32,18 +32,14 @@ from PyQt4 import QtCore
 from PyQt4.QtGui import QApplication, QDialog, QGridLayout, QVBoxLayout, QWidget, QTabWidget, QToolBox, \
                         QLabel, QLineEdit, QPushButton, QRadioButton, QGroupBox, QMessageBox, QFileDialog
 
-from math import radians, sin, cos
-
-from numpy import *
-
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import cm
-
 
+from geosurf_pure.array_utils import grid_axes, formula_to_arrays
+from geosurf_pure.spatial import GridSurface, AnalyticGeosurface, geographic_transformation, transform_xyz
+from geosurf_pure.errors import AnaliticSurfaceCalcException, AnaliticSurfaceIOException
 from geosurf_pure.surf_io import geosurface_export_vtk, geosurface_export_grass, geosurface_save_gas, \
-                           geosurface_export_xyz, geosurface_export_esri_generate
-
-from mpl.mpl_widget import view_3D_surface
+                           geosurface_export_xyz, geosurface_export_esri_generate, \
+                           geosurface_export_vtk_binary, geosurface_export_vtp, geosurface_export_ply, geosurface_export_stl, \
+                           geosurface_save_gas_container
 
 
 __version__ = "0.0.2"
@@ -218,18 +214,33 @@ class GeosurfaceSimulationDialog( QDialog):
   
         self.save_as_esri_generate_QRadioButton = QRadioButton( "3D ESRI generate")
         outputLayout.addWidget( self.save_as_esri_generate_QRadioButton, 1, 3, 1, 2 )
+
+        self.save_as_vtk_binary_QRadioButton = QRadioButton( "VTK binary")
+        outputLayout.addWidget( self.save_as_vtk_binary_QRadioButton, 2, 1, 1, 2 )
+
+        self.save_as_vtp_QRadioButton = QRadioButton( "VTK XML (vtp, zlib)")
+        outputLayout.addWidget( self.save_as_vtp_QRadioButton, 2, 3, 1, 2 )
+
+        self.save_as_ply_QRadioButton = QRadioButton( "PLY (binary)")
+        outputLayout.addWidget( self.save_as_ply_QRadioButton, 3, 1, 1, 2 )
+
+        self.save_as_stl_QRadioButton = QRadioButton( "STL (binary)")
+        outputLayout.addWidget( self.save_as_stl_QRadioButton, 3, 3, 1, 2 )
+
+        self.save_as_gas_container_QRadioButton = QRadioButton( "Gas binary (with surface)")
+        outputLayout.addWidget( self.save_as_gas_container_QRadioButton, 4, 1, 1, 2 )
                                            
         simulation_output_browse_QPushButton = QPushButton("Save as ...")
         simulation_output_browse_QPushButton.clicked.connect( self.select_output_file )
-        outputLayout.addWidget( simulation_output_browse_QPushButton, 2, 0, 1, 1 )
+        outputLayout.addWidget( simulation_output_browse_QPushButton, 5, 0, 1, 1 )
 
         self.output_filename_QLineEdit = QLineEdit()
-        outputLayout.addWidget( self.output_filename_QLineEdit, 2, 1, 1, 4 )
+        outputLayout.addWidget( self.output_filename_QLineEdit, 5, 1, 1, 4 )
             
         self.save_surface_pButton = QPushButton( "Save surface" )
         self.save_surface_pButton.clicked[bool].connect( self.save_surface ) 
         self.save_surface_pButton.setEnabled( True )       
-        outputLayout.addWidget( self.save_surface_pButton, 3, 0, 1, 5 )        
+        outputLayout.addWidget( self.save_surface_pButton, 6, 0, 1, 5 )        
         
         outputWidget.setLayout( outputLayout )
         
@@ -297,18 +308,15 @@ class GeosurfaceSimulationDialog( QDialog):
             QMessageBox.critical( self, "Surface simulation", "Define an analytical formula" )
             return
         
-        a_array = linspace( a_min, a_max, num=grid_cols )
-        b_array = linspace( b_max, b_min, num=grid_rows ) # note: reversed for conventional j order in arrays
-
         try:
-            a_list = [ a for a in a_array for b in b_array ]
-            b_list = [ b for a in a_array for b in b_array ]
-            z_list = [ eval( formula ) for a in a_array for b in b_array ]
-        except:
+            a_array, b_array = grid_axes( ( a_min, a_max, b_max, b_min ), # note: b values reversed for conventional j order in arrays 
+                                          ( grid_rows, grid_cols ) ) 
+            a_grid, b_grid, z_grid = formula_to_arrays( formula, a_array, b_array )
+        except AnaliticSurfaceCalcException:
             QMessageBox.critical( self, "Surface simulation", "Error in matrix calculation" )
             return
     
-        self.analytical_surface_abz = a_list, b_list, z_list 
+        self.analytical_surface_abz = GridSurface.from_arrays( a_grid, b_grid, z_grid, ( grid_rows, grid_cols ) ) 
         self.array_params = a_min, a_max, b_min, b_max 
         self.grid_dims = grid_rows, grid_cols 
 
@@ -328,6 +336,7 @@ class GeosurfaceSimulationDialog( QDialog):
         if self.analytical_surface_params is None:
             QMessageBox.critical( self, "Surface simulation", "Matrix not yet calculated" )
             return
+        from mpl.mpl_widget import view_3D_surface # matplotlib is loaded only when plotting
         view_3D_surface( self.analytical_surface_abz )
         
 
@@ -336,38 +345,10 @@ class GeosurfaceSimulationDialog( QDialog):
         if self.geographical_surface_params is None:
             QMessageBox.critical( self, "Surface simulation", "Geographic surface not yet calculated" )
             return         
+        from mpl.mpl_widget import view_3D_surface # matplotlib is loaded only when plotting
         view_3D_surface( self.simulated_geosurface )
         
 
-    def calculate_scale_matrix( self, a_range, b_range, grid_height, grid_width ):
-        
-        assert a_range > 0.0
-        assert b_range > 0.0
-        assert grid_height > 0.0
-        assert grid_width > 0.0
-                
-        sx = grid_width / a_range
-        sy = grid_height / b_range
-        
-        return array( [ ( sx , 0.0 ) , ( 0.0, sy ) ] )
-        
-
-    def rotation_matrix( self, grid_rot_angle_degr ):
-        
-        grid_rot_angle_rad = radians( grid_rot_angle_degr )
-        sin_rot_angle = sin( grid_rot_angle_rad )
-        cos_rot_angle = cos( grid_rot_angle_rad )
-        
-        return array( [ ( cos_rot_angle , -sin_rot_angle ) , ( sin_rot_angle, cos_rot_angle ) ] )
-
-
-    def calculate_offset_parameters( self, transformation_matrix, llc_point_matr, llc_point_geog):
-
-        llc_point_matr_offset = dot( transformation_matrix, llc_point_matr )
-                                                         
-        return llc_point_geog - llc_point_matr_offset
-           
-                                   
     def geosurface_XYZ( self ):
         
         try:            
@@ -387,31 +368,22 @@ class GeosurfaceSimulationDialog( QDialog):
             return  
         
         try:
-            X, Y, Z = self.analytical_surface_abz
+            self.analytical_surface_abz
             a_min, a_max, b_min, b_max = self.array_params 
             grid_rows, grid_cols = self.grid_dims  # just for checking input completeness
         except:            
             QMessageBox.critical( self, "Surface simulation", "Matrix not yet calculated" )
             return  
         
-        a_range, b_range = a_max-a_min, b_max-b_min
-        scale_matrix = self.calculate_scale_matrix( a_range, b_range, grid_height, grid_width )
-        rotation_matrix = self.rotation_matrix( grid_rot_angle_degr )
-
-        transformation_matrix = dot( rotation_matrix, scale_matrix )
-
-        offset_parameters_matrix = self.calculate_offset_parameters( transformation_matrix, 
-                                                                     array( [a_min, b_min] ),
-                                                                     array( [geog_x_min, geog_y_min] ) )
+        transformation_matrix, offset_matrix = geographic_transformation( ( a_min, a_max, b_min, b_max ),
+                                                                          ( ( geog_x_min, geog_y_min ), 
+                                                                            ( grid_height, grid_width ), 
+                                                                            grid_rot_angle_degr ) )
         
-        X_tr =[]; Y_tr =[]
-        for x, y in zip( X, Y ):
-            orig_pt = array([x,y])
-            trasl_pt = dot( transformation_matrix, orig_pt) + offset_parameters_matrix
-            X_tr.append( trasl_pt[0] )
-            Y_tr.append( trasl_pt[1] )
-            
-        self.simulated_geosurface = ( X_tr, Y_tr, Z )
+        self.simulated_geosurface = GridSurface.empty( self.grid_dims )
+        self.simulated_geosurface.xyz[:] = transform_xyz( self.analytical_surface_abz.xyz, 
+                                                          transformation_matrix, 
+                                                          offset_matrix )
 
         self.geographical_surface_params = {'geog x min': geog_x_min,
                                             'geog y min': geog_y_min,
@@ -426,18 +398,30 @@ class GeosurfaceSimulationDialog( QDialog):
 
     def select_output_file( self ):
             
-        if self.save_as_vtk_QRadioButton.isChecked():
+        if self.save_as_vtk_QRadioButton.isChecked() or self.save_as_vtk_binary_QRadioButton.isChecked():
             short_txt = "*.vtk"
             long_txt = "vtk (*.vtk *.VTK)"
+        elif self.save_as_vtp_QRadioButton.isChecked():
+            short_txt = "*.vtp"
+            long_txt = "vtp (*.vtp *.VTP)"
+        elif self.save_as_ply_QRadioButton.isChecked():
+            short_txt = "*.ply"
+            long_txt = "ply (*.ply *.PLY)"
+        elif self.save_as_stl_QRadioButton.isChecked():
+            short_txt = "*.stl"
+            long_txt = "stl (*.stl *.STL)"
         elif self.save_as_grass_QRadioButton.isChecked():
             short_txt = "*.txt"
             long_txt = "txt (*.txt *.TXT)"            
         elif self.save_as_gas_QRadioButton.isChecked():
             short_txt = "*.json"
             long_txt = "json (*.json *.JSON)" 
+        elif self.save_as_gas_container_QRadioButton.isChecked():
+            short_txt = "*.gasb"
+            long_txt = "gas binary (*.gasb *.GASB)" 
         elif self.save_as_xyz_QRadioButton.isChecked():
             short_txt = "*.xyz"
-            long_txt = "xyz (*.xyz *.XYZ)" 
+            long_txt = "xyz (*.xyz *.XYZ);;gzipped xyz (*.xyz.gz *.XYZ.GZ)" 
         elif self.save_as_esri_generate_QRadioButton.isChecked():
             short_txt = "*.*"
             long_txt = "generate file (*.*)"             
@@ -463,6 +447,14 @@ class GeosurfaceSimulationDialog( QDialog):
         geodata = self.simulated_geosurface, self.grid_dims        
         if self.save_as_vtk_QRadioButton.isChecked():
             save_function = geosurface_export_vtk
+        elif self.save_as_vtk_binary_QRadioButton.isChecked():
+            save_function = geosurface_export_vtk_binary
+        elif self.save_as_vtp_QRadioButton.isChecked():
+            save_function = geosurface_export_vtp
+        elif self.save_as_ply_QRadioButton.isChecked():
+            save_function = geosurface_export_ply
+        elif self.save_as_stl_QRadioButton.isChecked():
+            save_function = geosurface_export_stl
         elif self.save_as_grass_QRadioButton.isChecked():
             save_function = geosurface_export_grass 
         elif self.save_as_xyz_QRadioButton.isChecked():
@@ -471,6 +463,19 @@ class GeosurfaceSimulationDialog( QDialog):
             save_function = geosurface_save_gas
             geodata = {'analytical surface': self.analytical_surface_params,
                        'geographical params': self.geographical_surface_params }        
+        elif self.save_as_gas_container_QRadioButton.isChecked():
+            save_function = geosurface_save_gas_container
+            # recalculated by the engine, since the stored nodes must follow its grid order 
+            # (b values increasing, instead of reversed as in this dialog)
+            try:
+                anal_geosurface = AnalyticGeosurface( self.analytical_surface_params, self.geographical_surface_params, [] )
+            except ( AnaliticSurfaceIOException, AnaliticSurfaceCalcException ), msg:
+                QMessageBox.critical( self, "Surface saving", str(msg) )
+                return
+            geodata = {'analytical surface': self.analytical_surface_params,
+                       'geographical params': self.geographical_surface_params }, \
+                      anal_geosurface.geosurface_XYZ(), \
+                      anal_geosurface.surface_z_range()
         elif self.save_as_esri_generate_QRadioButton.isChecked():
             save_function = geosurface_export_esri_generate
             
@@ -501,6 +506,7 @@ def main():
     app.exec_()
 
 
-main()
+if __name__ == "__main__":
+    main()
 
 
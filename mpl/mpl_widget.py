@@ -21,8 +21,13 @@ from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as Navigatio
 from matplotlib.figure import Figure
 from mpl_toolkits.mplot3d import Axes3D
 
+from geosurf_pure.topology import grid_triangles, grid_decimation_step
+
 from .utils import valid_intervals
 
+
+VIEW_MAX_FACES = 100000 # maximum number of plotted triangles of a 3D surface
+
        
 
 class MplCanvas(FigureCanvas):
@@ -112,14 +117,23 @@ def plot_filled_line( axes, x_list, y_list, plot_y_min, facecolor, alpha = 0.1 )
                           alpha = alpha )
 
   
-def view_3D_surface( surface_3d ):
+def view_3D_surface( surface_3d, max_faces = VIEW_MAX_FACES ):
+    """
+    Plots a grid surface, triangulated with the cached grid topology instead of a Delaunay triangulation,
+    so that also surfaces made multivalued by the deformations (e.g., vertical shear) are correctly displayed.
+    Larger surfaces are decimated, so that the plotted triangles are at most max_faces.
+    """
+    
+    decimation_step = grid_decimation_step( surface_3d.grid_dims, max_faces )
+    if decimation_step > 1:
+        surface_3d = surface_3d.subsampled( decimation_step, decimation_step )
            
     X, Y, Z = surface_3d
         
     # tripcolor plot.
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1, projection='3d')
-    ax.plot_trisurf( X, Y, Z, cmap=cm.jet, linewidth=0.1 )
+    ax.plot_trisurf( X, Y, Z, triangles=grid_triangles( surface_3d.grid_dims ), cmap=cm.jet, linewidth=0.1 )
     ax.autoscale(enable=True, axis='both', tight=True)
     plt.show()
     
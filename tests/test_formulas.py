@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import unittest
+
+import numpy as np
+
+from geosurf_pure.formulas import compile_formula, eval_formula, clear_formula_cache
+from geosurf_pure.errors import AnaliticSurfaceCalcException
+
+
+class FormulaWhitelistTest( unittest.TestCase ):
+
+    def setUp( self ):
+
+        clear_formula_cache()
+
+    def test_allowed_formula( self ):
+
+        code = compile_formula( 'sin( a ) * b + abs( a ) ** 2 / pi' )
+
+        self.assertAlmostEqual( eval_formula( code, 1.0, 2.0 ), np.sin( 1.0 ) * 2.0 + 1.0 / np.pi )
+
+    def test_builtins_rejected( self ):
+
+        for formula in ( '__builtins__', 'a + len( __builtins__ )', '__builtins__[ "a" ]' ):
+            self.assertRaises( AnaliticSurfaceCalcException, compile_formula, formula )
+
+    def test_unknown_names_rejected( self ):
+
+        for formula in ( 'open( "f" )', '__import__( "os" )', 'c * a', 'a.__class__' ):
+            self.assertRaises( AnaliticSurfaceCalcException, compile_formula, formula )
+
+
+if __name__ == '__main__':
+    unittest.main()
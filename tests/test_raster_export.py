@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__  import division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from geosurf_pure.spatial import GridSurface
+from geosurf_pure.raster import rasterize_surface
+from geosurf_pure.surf_io import grid_export_esri_ascii, grid_export_float
+
+
+def read_esri_header( headerfile, n_lines = 6 ):
+
+    return dict( headerfile.readline().split() for _ in xrange( n_lines ) )
+
+
+class RasterExportRoundTripTest( unittest.TestCase ):
+
+    def setUp( self ):
+
+        self.temp_dir = tempfile.mkdtemp()
+
+        # plane z = x + 2y, with an extent whose cell sizes, recalculated from the raster domain,
+        # differ in the last bits (0.09999999999999981 and 0.09999999999999938)
+        a_grid, b_grid = np.meshgrid( np.linspace( 1000.3, 1012.7, 41 ), np.linspace( 2000.1, 2007.3, 21 ), indexing = 'ij' )
+        geosurface = GridSurface.from_arrays( a_grid, b_grid, a_grid + 2 * b_grid, ( 21, 41 ) )
+
+        self.grid = rasterize_surface( geosurface, 0.1 )
+
+    def tearDown( self ):
+
+        shutil.rmtree( self.temp_dir )
+
+    def test_esri_ascii( self ):
+
+        output_filepath = os.path.join( self.temp_dir, 'surface.asc' )
+        self.assertTrue( grid_export_esri_ascii( output_filepath, self.grid ) )
+
+        with open( output_filepath ) as infile:
+            header = read_esri_header( infile )
+            values = np.loadtxt( infile, ndmin = 2 )
+
+        self.assertEqual( header[ 'cellsize' ], '0.1' )
+        self.assertEqual( ( int( header[ 'nrows' ] ), int( header[ 'ncols' ] ) ), self.grid.data.shape )
+        self.assertEqual( float( header[ 'xllcorner' ] ), self.grid.xmin )
+        self.assertEqual( float( header[ 'yllcorner' ] ), self.grid.ymin )
+
+        expected_values = np.where( np.isnan( self.grid.data ), -9999, np.round( self.grid.data, 4 ) )
+        np.testing.assert_allclose( values, expected_values, rtol = 0, atol = 1e-9 )
+
+    def test_float( self ):
+
+        output_filepath = os.path.join( self.temp_dir, 'surface.flt' )
+        self.assertTrue( grid_export_float( output_filepath, self.grid ) )
+
+        with open( os.path.join( self.temp_dir, 'surface.hdr' ) ) as headerfile:
+            header = read_esri_header( headerfile, 7 )
+        values = np.fromfile( output_filepath, dtype = '<f4' ).reshape( self.grid.data.shape )
+
+        self.assertEqual( header[ 'cellsize' ], '0.1' )
+        self.assertEqual( header[ 'byteorder' ], 'LSBFIRST' )
+        np.testing.assert_array_equal( values, np.where( np.isnan( self.grid.data ), -9999, self.grid.data ).astype( np.float32 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()